@@ -1,61 +1,468 @@
+import time
+# Taken before every other import so cold_start_ms includes loading flask, supabase, reportlab and numpy
+IMPORT_STARTED = time.perf_counter()
+
 import os
+import sys
+import copy
+import uuid
+import queue
+import atexit
+import random
+import logging
+import io
+import json
+import csv
 import smtplib
-from flask import Flask, jsonify, request
+import zipfile
+import multiprocessing
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import Blueprint, Flask, Response, current_app, g, has_request_context, jsonify, request, stream_with_context
 from flask_cors import CORS
 from supabase import create_client, Client
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
+from werkzeug.local import LocalProxy
 from werkzeug.security import generate_password_hash, check_password_hash
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
+import forecasting
+import invoice_pdf
+
 # ==========================================
 # CONFIGURATION & SETUP
 # ==========================================
+load_dotenv()
 SMTP_EMAIL = os.environ.get("SMTP_EMAIL")
 SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD")
-load_dotenv()
-app = Flask(__name__)
-CORS(app)
 
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
+api = Blueprint('api', __name__)
+
+# ==========================================
+# LOGGING
+# ==========================================
+# Request threads only enqueue records; a QueueListener thread formats them as JSON and writes.
+logger = logging.getLogger("ergin")
+
+LOG_QUEUE_SIZE = 10000
+# Fraction of records kept per level, e.g. LOG_SAMPLE_INFO=0.1 keeps one access line in ten
+LOG_SAMPLE_RATES = {
+    level: float(os.environ.get(f"LOG_SAMPLE_{logging.getLevelName(level)}", 1.0))
+    for level in (logging.DEBUG, logging.INFO, logging.WARNING)
+}
+
+# Attributes every LogRecord has; anything else came in through `extra=` and is emitted as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "msg": record.getMessage()
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS})
+        if record.exc_info:
+            entry["error"] = str(record.exc_info[1])
+            entry["traceback"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RequestContextFilter(logging.Filter):
+    # Runs on the request thread (before enqueueing) so it can still read flask.g
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = getattr(g, "request_id", None)
+            record.endpoint = request.endpoint
+        return True
+
+class SamplingFilter(logging.Filter):
+    def filter(self, record):
+        rate = LOG_SAMPLE_RATES.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+class NonBlockingQueueHandler(QueueHandler):
+    # Drops records instead of waiting when the listener falls behind
+    dropped = 0
+
+    def prepare(self, record):
+        # Defer formatting to the listener; only freeze the message so later mutation of args is harmless
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+_log_listener = None
+
+def configure_logging():
+    # Idempotent: create_app() may run more than once per process (tests, warm restarts)
+    global _log_listener
+    if _log_listener is not None:
+        return
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter())
+    handler.addFilter(RequestContextFilter())
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+    _log_listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
+    logger.handlers[:] = [handler]
+    logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+def count_upstream_call():
+    if has_request_context():
+        g.upstream_calls = getattr(g, "upstream_calls", 0) + 1
+
+_supabase_client = None
+_supabase_lock = threading.Lock()
+
+def get_supabase() -> Client:
+    # Builds the Supabase client on first use so importing the app never touches the network
+    global _supabase_client
+    if _supabase_client is None:
+        with _supabase_lock:
+            if _supabase_client is None:
+                url = os.environ.get("SUPABASE_URL")
+                key = os.environ.get("SUPABASE_KEY")
+                if not url or not key:
+                    raise ValueError("Missing SUPABASE_URL or SUPABASE_KEY. Check your .env file!")
+                _supabase_client = create_client(url, key)
+    return _supabase_client
+
+class CountingClient:
+    # Thin wrapper that counts one upstream call per `table(...)` query or `rpc(...)` for the access log
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name):
+        count_upstream_call()
+        return self._client.table(name)
+
+    def rpc(self, fn, params=None):
+        count_upstream_call()
+        return self._client.rpc(fn, params or {})
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+# Routes keep using `supabase.table(...)`; the proxy resolves to the lazily built client
+supabase: Client = LocalProxy(lambda: CountingClient(get_supabase()))
+
+def map_fields(data, fields):
+    # Maps incoming React/CSV keys to database columns using a {column: key} table
+    return {column: data.get(key) for column, key in fields.items()}
+
+# ==========================================
+# REFERENCE CACHES
+# ==========================================
+# In-process lookup indexes for rarely-changing reference data (names, categories).
+# Live figures such as stock are always read straight from Supabase.
+CACHE_TTL_SECONDS = int(os.environ.get("CACHE_TTL_SECONDS", 300))
+
+# Paged through fetch_all_rows so catalogs past PostgREST's 1000-row cap are fully indexed
+CACHE_LOADERS = {
+    "products": lambda: {p['product_id']: p for p in
+                         fetch_all_rows(lambda: supabase.table('product').select('*').order('product_id'))},
+    "customers": lambda: {c['customer_id']: c for c in
+                          fetch_all_rows(lambda: supabase.table('customer').select('*').order('customer_id'))},
+}
+
+_cache = {}
+_cache_lock = threading.Lock()
+# Bumped on every invalidation, so a load that overlapped one does not store what it read
+_cache_versions = {}
+# Set once every index has loaded; invalidating an entry afterwards does not make the worker cold again
+_warmed = threading.Event()
+
+def get_index(name):
+    # Returns the cached id -> row index, reloading it when missing or older than the TTL
+    entry = _cache.get(name)
+    if entry and time.monotonic() - entry[0] < CACHE_TTL_SECONDS:
+        return entry[1]
+    with _cache_lock:
+        entry = _cache.get(name)
+        if entry and time.monotonic() - entry[0] < CACHE_TTL_SECONDS:
+            return entry[1]
+        version = _cache_versions.get(name, 0)
+        index = CACHE_LOADERS[name]()
+        if version == _cache_versions.get(name, 0):
+            _cache[name] = (time.monotonic(), index)
+        return index
+
+def invalidate_index(name):
+    # Drops the index here right away and, through the event broker (and its relay), in every other
+    # worker too, so a client renamed on one worker does not stay stale on the rest until the TTL
+    drop_index(name)
+    event_broker.publish("cache", index=name)
+
+def drop_index(name):
+    _cache_versions[name] = _cache_versions.get(name, 0) + 1
+    _cache.pop(name, None)
+    if name == "products":
+        # Any catalog change (add, edit, delete, archive, bulk, import) can change reorder suggestions
+        invalidate_reorder_suggestions()
+
+def caches_warm():
+    return _warmed.is_set()
+
+def warm_up():
+    # Pre-populates every reference index so the first real request is not a cold one
+    for name in CACHE_LOADERS:
+        get_index(name)
+    _warmed.set()
+
+# ==========================================
+# REQUEST COALESCING (SINGLE-FLIGHT)
+# ==========================================
+class SingleFlight:
+    # Lets concurrent identical reads share one in-flight upstream call and its result
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {"executed": 0, "coalesced": 0}
+        # Bumped after every write request so later reads never join a flight that started before it
+        self.generation = 0
+
+    def note_write(self):
+        with self._lock:
+            self.generation += 1
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None}
+                self.stats["executed"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["done"].set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+single_flight = SingleFlight()
+
+def coalesce(endpoint, fn):
+    # Keys on the endpoint, its sorted query string and the write generation, so ?a=1&b=2 and
+    # ?b=2&a=1 share a flight but a read issued after a write always starts a fresh one.
+    # Callers must treat the returned data as read-only since other requests hold the same object.
+    params = tuple(sorted(request.args.items(multi=True)))
+    return single_flight.do((endpoint, params, single_flight.generation), fn)
+
+@api.after_app_request
+def note_write_request(response):
+    # Runs before the response reaches the client, so its follow-up refetch sees the new generation
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        single_flight.note_write()
+    return response
 
-if not url or not key:
-    raise ValueError("Missing SUPABASE_URL or SUPABASE_KEY. Check your .env file!")
+# ==========================================
+# LIVE EVENTS (SERVER-SENT EVENTS)
+# ==========================================
+class EventBroker:
+    # One shared ring buffer per worker; subscribers remember the last sequence number they saw
+    # and block on a Condition, so fan-out costs no per-client queue or background thread.
+    def __init__(self, history=1000):
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=history)
+        self._seq = 0
+        self.subscribers = 0
+        # Set by start_event_relay() when events must also reach the other gunicorn workers
+        self.relay = None
+
+    def publish(self, event_type, **payload):
+        # The write has landed: reads from here on must not join a flight that started before it
+        single_flight.note_write()
+        # Through the relay every worker, this one included, receives the event from its listener
+        if self.relay is not None and self.relay.send(event_type, payload):
+            return
+        self.deliver(event_type, payload)
+
+    def deliver(self, event_type, payload):
+        # Relayed events carry writes made on other workers; pages refetch on them, so those
+        # refetches must not join a flight on this worker that predates the write either
+        single_flight.note_write()
+        if event_type == "cache":
+            drop_index(payload["index"])
+        elif event_type == "stock":
+            # Stock moved (possibly on another worker): cached reorder suggestions are out of date
+            invalidate_reorder_suggestions()
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, event_type, payload))
+            self._cond.notify_all()
+
+    def subscribe(self, delta=1, limit=None):
+        # Returns False (and does not count the subscriber) when the limit is already reached
+        with self._cond:
+            if delta > 0 and limit is not None and self.subscribers >= limit:
+                return False
+            self.subscribers += delta
+            return True
+
+    def latest_seq(self):
+        with self._cond:
+            return self._seq
+
+    def oldest_seq(self):
+        # Sequence number of the oldest event still buffered (latest + 1 when nothing is buffered)
+        with self._cond:
+            return self._events[0][0] if self._events else self._seq + 1
+
+    def wait_for(self, last_seq, timeout):
+        # Returns events newer than last_seq, waiting up to timeout seconds for the first one
+        with self._cond:
+            if self._seq <= last_seq:
+                self._cond.wait(timeout)
+            return [e for e in self._events if e[0] > last_seq]
+
+event_broker = EventBroker()
+SSE_HEARTBEAT_SECONDS = 15
+# Every open stream holds a worker thread; keep this below gunicorn's threads so API calls still get one
+SSE_MAX_SUBSCRIBERS = int(os.environ.get("SSE_MAX_SUBSCRIBERS", 32))
 
-supabase: Client = create_client(url, key)
+# ==========================================
+# CROSS-WORKER EVENT RELAY (POSTGRES LISTEN/NOTIFY)
+# ==========================================
+# Each gunicorn worker has its own broker, so with more than one worker a sale made through
+# worker A would never reach pages streaming from worker B. When DATABASE_URL (the Supabase
+# Postgres connection string) is set, events are sent with NOTIFY and every worker's listener
+# thread delivers them into its local broker.
+EVENT_CHANNEL = "ergin_events"
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+EVENT_PAYLOAD_LIMIT = 7900
+
+class PgEventRelay:
+    def __init__(self, dsn, broker):
+        import psycopg
+        self._psycopg = psycopg
+        self.dsn = dsn
+        self.broker = broker
+        self._conn = None
+        self._lock = threading.Lock()
+        self.listening = False
+        self.reconnects = 0
+
+    def send(self, event_type, payload):
+        # True when the event went out through NOTIFY; False tells the broker to deliver it locally
+        message = json.dumps({"type": event_type, "payload": payload}, separators=(',', ':'))
+        local_copy = not self.listening
+        if len(message) > EVENT_PAYLOAD_LIMIT:
+            # Too big to relay (e.g. a large bulk archive): deliver it here, tell the other workers to refetch
+            message = json.dumps({"type": "resync", "payload": {"reason": f"large {event_type} event"}})
+            local_copy = True
+        try:
+            with self._lock:
+                if self._conn is None or self._conn.closed:
+                    self._conn = self._psycopg.connect(self.dsn, autocommit=True)
+                self._conn.execute("SELECT pg_notify(%s, %s)", (EVENT_CHANNEL, message))
+        except Exception:
+            logger.exception("EVENT RELAY NOTIFY ERROR")
+            with self._lock:
+                self._conn = None
+            return False
+        # While our own listener is reconnecting it would miss the NOTIFY, so deliver locally too
+        return not local_copy
+
+    def listen(self):
+        backoff = 1
+        while True:
+            try:
+                with self._psycopg.connect(self.dsn, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {EVENT_CHANNEL}")
+                    self.listening = True
+                    backoff = 1
+                    if self.reconnects:
+                        # Anything sent while we were disconnected is lost; make open pages refetch
+                        self.broker.deliver("resync", {"reason": "relay reconnected"})
+                    for notify in conn.notifies():
+                        message = json.loads(notify.payload)
+                        self.broker.deliver(message["type"], message["payload"])
+            except Exception:
+                logger.exception("EVENT RELAY LISTEN ERROR")
+            self.listening = False
+            self.reconnects += 1
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+def start_event_relay():
+    # Idempotent, like configure_logging(); without DATABASE_URL events stay inside this worker
+    dsn = os.environ.get("DATABASE_URL")
+    if not dsn or event_broker.relay is not None:
+        return
+    relay = PgEventRelay(dsn, event_broker)
+    threading.Thread(target=relay.listen, name="event-relay", daemon=True).start()
+    event_broker.relay = relay
+
+def publish_stock_change(product_id, delta, stock, reason):
+    invalidate_reorder_suggestions()
+    event_broker.publish("stock", product_id=product_id, delta=delta, stock=stock, reason=reason)
 
 # ==========================================
 # SUPPLIER MANAGEMENT
 # ==========================================
-@app.route('/api/suppliers', methods=['GET'])
+SUPPLIER_FIELDS = {
+    "supplier_name": "name",
+    "contact": "contact",
+    "email": "email",
+    "address": "address"
+}
+
+@api.route('/api/suppliers', methods=['GET'])
 def get_suppliers():
     # Retrieves all records from the supplier table
     try:
-        response = supabase.table('supplier').select("*").execute()
-        return jsonify(response.data)
+        suppliers = coalesce('suppliers', lambda: supabase.table('supplier').select("*").execute().data)
+        return jsonify(suppliers)
     except Exception as e:
-        print("--- GET SUPPLIERS ERROR ---", e)
+        logger.exception("GET SUPPLIERS ERROR")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/suppliers', methods=['POST'])
+@api.route('/api/suppliers', methods=['POST'])
 def add_supplier():
     try:
         data = request.json
-        mapped_data = {
-            "supplier_name": data.get("name"),
-            "contact": data.get("contact"),
-            "email": data.get("email"),
-            "address": data.get("address")
-        }
+        mapped_data = map_fields(data, SUPPLIER_FIELDS)
         response = supabase.table('supplier').insert(mapped_data).execute()
         return jsonify(response.data)
     except Exception as e:
-        print("--- ADD SUPPLIER ERROR ---", e)
+        logger.exception("ADD SUPPLIER ERROR")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/suppliers/<int:supplier_id>', methods=['PUT'])
+@api.route('/api/suppliers/<int:supplier_id>', methods=['PUT'])
 def update_supplier(supplier_id):
     # Updates an existing supplier's details
     try:
@@ -70,17 +477,20 @@ def update_supplier(supplier_id):
         }
             
         response = supabase.table('supplier').update(mapped_data).eq('supplier_id', supplier_id).execute()
+        invalidate_reorder_suggestions()
             
         return jsonify(response.data), 200
     except Exception as e:
-        print(f"--- UPDATE SUPPLIER {supplier_id} ERROR ---", e)
+        logger.exception(f"UPDATE SUPPLIER {supplier_id} ERROR")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/suppliers/<int:supplier_id>/archive', methods=['PUT'])
+@api.route('/api/suppliers/<int:supplier_id>/archive', methods=['PUT'])
 def archive_supplier(supplier_id):
     try:
         data = request.json
         response = supabase.table('supplier').update({'is_archived': data.get('is_archived')}).eq('supplier_id', supplier_id).execute()
+        invalidate_reorder_suggestions()
+        event_broker.publish("archive", entity="supplier", id=supplier_id, is_archived=data.get('is_archived'))
         return jsonify({"success": True}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -88,70 +498,74 @@ def archive_supplier(supplier_id):
 # ==========================================
 # PRODUCT & INVENTORY MANAGEMENT
 # ==========================================
-@app.route('/api/inventory', methods=['GET'])
+PRODUCT_FIELDS = {
+    "product_name": "name",
+    "category": "category",
+    "retail_price": "retail_price",
+    "selling_price": "selling_price"
+}
+
+@api.route('/api/inventory', methods=['GET'])
 def get_inventory():
     # Retrieves all products from the inventory
     try:
-        response = supabase.table('product').select("*").execute()
-        return jsonify(response.data)
+        products = coalesce('inventory', lambda: supabase.table('product').select("*").execute().data)
+        return jsonify(products)
     except Exception as e:
-        print("--- GET INVENTORY ERROR ---", e)
+        logger.exception("GET INVENTORY ERROR")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/product', methods=['POST'])
+@api.route('/api/product', methods=['POST'])
 def add_product():
     try:
         data = request.json
-        mapped_data = {
-            "product_name": data.get("name"),
-            "category": data.get("category"),
-            "stock": 0,
-            "retail_price": data.get("retail_price"),
-            "selling_price": data.get("selling_price")
-        }
+        mapped_data = {**map_fields(data, PRODUCT_FIELDS), "stock": 0}
         response = supabase.table('product').insert(mapped_data).execute()
+        invalidate_index('products')
+        for row in response.data:
+            event_broker.publish("product", action="added", product_id=row['product_id'])
         return jsonify(response.data)
     except Exception as e:
-        print("--- ADD PRODUCT ERROR ---", e)
+        logger.exception("ADD PRODUCT ERROR")
         return jsonify({"error": str(e)}), 500
     
 # UPDATE: Edit existing product details
-@app.route('/api/product/<int:product_id>', methods=['PUT'])
+@api.route('/api/product/<int:product_id>', methods=['PUT'])
 def update_product(product_id):
     try:
         data = request.json
-        print(f"--- INCOMING EDIT DATA FOR PRODUCT {product_id} ---", data)
+        logger.debug(f"INCOMING EDIT DATA FOR PRODUCT {product_id}", extra={"fields": sorted(data or {})})
         
-        mapped_data = {
-            "product_name": data.get("name"),
-            "category": data.get("category"),
-            "retail_price": data.get("retail_price"),
-            "selling_price": data.get("selling_price")
-        }
+        mapped_data = map_fields(data, PRODUCT_FIELDS)
         
         response = supabase.table('product').update(mapped_data).eq('product_id', product_id).execute()
+        invalidate_index('products')
+        event_broker.publish("product", action="updated", product_id=product_id)
         return jsonify(response.data), 200
         
     except Exception as e:
-        print(f"\n!!! UPDATE PRODUCT {product_id} ERROR !!!")
-        print(e)
+        logger.exception(f"UPDATE PRODUCT {product_id} ERROR")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/inventory/<item_id>', methods=['DELETE'])
+@api.route('/api/inventory/<item_id>', methods=['DELETE'])
 def delete_item(item_id):
     # Deletes a specific product from the inventory by product_id
     try:
         response = supabase.table('product').delete().eq('product_id', item_id).execute()
+        invalidate_index('products')
+        event_broker.publish("product", action="deleted", product_id=item_id)
         return jsonify(response.data)
     except Exception as e:
-        print("--- DELETE PRODUCT ERROR ---", e)
+        logger.exception("DELETE PRODUCT ERROR")
         return jsonify({"error": str(e)}), 500
     
-@app.route('/api/product/<int:product_id>/archive', methods=['PUT'])
+@api.route('/api/product/<int:product_id>/archive', methods=['PUT'])
 def archive_product(product_id):
     try:
         data = request.json
         supabase.table('product').update({'is_archived': data.get('is_archived')}).eq('product_id', product_id).execute()
+        invalidate_index('products')
+        event_broker.publish("archive", entity="product", id=product_id, is_archived=data.get('is_archived'))
         return jsonify({"success": True}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -159,7 +573,7 @@ def archive_product(product_id):
 # ==========================================
 # USER AUTHENTICATION
 # ==========================================
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def login():
     # Authenticates a user using secure password hashing with a plaintext fallback
     try:
@@ -182,13 +596,13 @@ def login():
             return jsonify({"success": False, "message": "Invalid username"}), 401
 
     except Exception as e:
-        print("--- LOGIN ERROR ---", e) 
+        logger.exception("LOGIN ERROR")
         return jsonify({"error": str(e)}), 500
 
 # ==========================================
 # RESTOCKING TRANSACTIONS
 # ==========================================
-@app.route('/api/restock', methods=['POST'])
+@api.route('/api/restock', methods=['POST'])
 def process_restock():
     # Processes a complex delivery transaction across multiple tables
     try:
@@ -229,6 +643,7 @@ def process_restock():
                 "stock": current_stock + qty,
                 "supplier_id": supplier_id
             }).eq('product_id', p_id).execute()
+            publish_stock_change(p_id, qty, current_stock + qty, "restock")
             
             supabase.table('inventory_log').insert({
                 "product_id": p_id,
@@ -240,72 +655,71 @@ def process_restock():
         return jsonify({"success": True, "batch_id": batch_id}), 201
 
     except Exception as e:
-        print("--- RESTOCK TRANSACTION ERROR ---", e)
+        logger.exception("RESTOCK TRANSACTION ERROR")
         return jsonify({"error": str(e)}), 500
 
 # ==========================================
 # CLIENT MANAGEMENT
 # ==========================================
-@app.route('/api/clients', methods=['GET'])
+CLIENT_FIELDS = {
+    "name": "name",
+    "address": "address",
+    "contact": "contact",
+    "email": "email",
+    "business_style": "business_style",
+    "tin": "tin"
+}
+
+@api.route('/api/clients', methods=['GET'])
 def get_clients():
     # Retrieves all customer records
     try:
-        response = supabase.table('customer').select("*").execute()
-        return jsonify(response.data)
+        clients = coalesce('clients', lambda: supabase.table('customer').select("*").execute().data)
+        return jsonify(clients)
     except Exception as e:
-        print("--- GET CLIENTS ERROR ---", e)
+        logger.exception("GET CLIENTS ERROR")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/clients', methods=['POST'])
+@api.route('/api/clients', methods=['POST'])
 def add_client():
     # Inserts a new customer record
     try:
         data = request.json
-        mapped_data = {
-            "name": data.get("name"),
-            "address": data.get("address"),
-            "contact": data.get("contact"),
-            "email": data.get("email"),
-            "business_style": data.get("business_style"),
-            "tin": data.get("tin")
-        }
+        mapped_data = map_fields(data, CLIENT_FIELDS)
         
         response = supabase.table('customer').insert(mapped_data).execute()
+        invalidate_index('customers')
         return jsonify(response.data)
     except Exception as e:
-        print("--- ADD CLIENT ERROR ---", e)
+        logger.exception("ADD CLIENT ERROR")
         return jsonify({"error": str(e)}), 500
     
-@app.route('/api/clients/<int:client_id>', methods=['PUT'])
+@api.route('/api/clients/<int:client_id>', methods=['PUT'])
 def update_client(client_id):
     try:
         data = request.json
 
-        mapped_data = {
-            "name": data.get("name"),
-            "address": data.get("address"),
-            "contact": data.get("contact"),
-            "email": data.get("email"),
-            "business_style": data.get("business_style"),
-            "tin": data.get("tin")
-        }
+        mapped_data = map_fields(data, CLIENT_FIELDS)
 
         response = supabase.table('customer') \
             .update(mapped_data) \
             .eq('customer_id', client_id) \
             .execute()
+        invalidate_index('customers')
 
         return jsonify({"success": True, "data": response.data}), 200
 
     except Exception as e:
-        print("--- UPDATE CLIENT ERROR ---", e)
+        logger.exception("UPDATE CLIENT ERROR")
         return jsonify({"error": str(e)}), 500
     
-@app.route('/api/clients/<int:client_id>/archive', methods=['PUT'])
+@api.route('/api/clients/<int:client_id>/archive', methods=['PUT'])
 def archive_client(client_id):
     try:
         data = request.json
         response = supabase.table('customer').update({'is_archived': data.get('is_archived')}).eq('customer_id', client_id).execute()
+        invalidate_index('customers')
+        event_broker.publish("archive", entity="client", id=client_id, is_archived=data.get('is_archived'))
         return jsonify({"success": True}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -313,7 +727,7 @@ def archive_client(client_id):
 # ==========================================
 # POS / SALES TRANSACTIONS / SALES RECORD
 # ==========================================
-@app.route('/api/sales', methods=['POST'])
+@api.route('/api/sales', methods=['POST'])
 def process_sale():
     # Processes a POS transaction, deducts stock, and logs the event
     try:
@@ -359,6 +773,7 @@ def process_sale():
             supabase.table('product').update({
                 "stock": safe_new_stock 
             }).eq('product_id', p_id).execute()
+            publish_stock_change(p_id, safe_new_stock - current_stock, safe_new_stock, "sale")
             
             # Step 4: Write to Audit Log (inventory_log)
             supabase.table('inventory_log').insert({
@@ -396,34 +811,43 @@ def process_sale():
                     supabase.table('product_batches').update({"qty_remaining": 0}).eq('batch_id', batch_id).execute()
                     qty_to_deduct -= available_in_batch
 
+        event_broker.publish("sale", sales_id=sales_id, customer_id=customer_id, total_amount=total_amount, date=current_date)
+
+        # The sale itself is already saved; a ledger failure is logged and can be repaired by the backfill
+        if customer_id:
+            try:
+                record_charge(customer_id, sales_id, total_amount, current_date)
+                if data.get('amount_paid'):
+                    record_payment(customer_id, data.get('amount_paid'), current_date, f"POS INV-{sales_id}")
+            except Exception:
+                logger.exception(f"LEDGER CHARGE FOR SALE {sales_id} ERROR")
+
         return jsonify({"success": True, "sales_id": sales_id}), 201
 
     except Exception as e:
-        print("--- SALE TRANSACTION ERROR ---", e)
+        logger.exception("SALE TRANSACTION ERROR")
         return jsonify({"error": str(e)}), 500
 
-@app.route("/api/sales/<int:sales_id>/remarks", methods=["PUT"])
+@api.route("/api/sales/<int:sales_id>/remarks", methods=["PUT"])
 def update_remarks(sales_id):
     try:
         data = request.json
         remarks = data.get("remarks")
 
-        print("Saving remarks:", remarks, "for sale:", sales_id)
-
         response = supabase.table('sales_transaction') \
             .update({"remarks": remarks}) \
             .eq('sales_id', sales_id) \
             .execute()
 
-        print("Supabase response:", response)
+        logger.debug(f"SAVED REMARKS FOR SALE {sales_id}", extra={"rows": len(response.data)})
 
         return jsonify({"success": True}), 200
 
     except Exception as e:
-        print(" UPDATE REMARKS ERROR:", str(e))
+        logger.exception("UPDATE REMARKS ERROR")
         return jsonify({"error": str(e)}), 500
     
-@app.route('/api/send-invoice-email', methods=['POST'])
+@api.route('/api/send-invoice-email', methods=['POST'])
 def send_invoice_email():
     data = request.json
 
@@ -521,96 +945,106 @@ def send_invoice_email():
         return jsonify({"message": "Email sent successfully"}), 200
 
     except Exception as e:
-        print("Email error:", e)
+        logger.exception("EMAIL ERROR")
         return jsonify({"error": str(e)}), 500
     
 # ==========================================
 # DASHBOARD METRICS
 # ==========================================
-@app.route('/api/dashboard', methods=['GET'])
+def build_dashboard_data():
+    prod_res = supabase.table('product').select('*').execute()
+    products = prod_res.data
+    
+    low_stock_items = [p for p in products if p.get('stock', 0) <= 10]
+    
+    sales_res = supabase.table('sales_transaction').select('*').execute()
+    sales = sales_res.data
+    
+    total_revenue = sum(float(s.get('total_amount', 0)) for s in sales)
+    recent_sales = sorted(sales, key=lambda x: x['sales_id'], reverse=True)[:5]
+    
+    return {
+        "total_revenue": total_revenue,
+        "total_sales_count": len(sales),
+        "total_products": len(products),
+        "low_stock_count": len(low_stock_items),
+        "low_stock_items": low_stock_items,
+        "recent_sales": recent_sales
+    }
+
+@api.route('/api/dashboard', methods=['GET'])
 def get_dashboard_data():
     # Aggregates KPI data for the main dashboard view
     try:
-        prod_res = supabase.table('product').select('*').execute()
-        products = prod_res.data
-        
-        low_stock_items = [p for p in products if p.get('stock', 0) <= 10]
-        
-        sales_res = supabase.table('sales_transaction').select('*').execute()
-        sales = sales_res.data
-        
-        total_revenue = sum(float(s.get('total_amount', 0)) for s in sales)
-        recent_sales = sorted(sales, key=lambda x: x['sales_id'], reverse=True)[:5]
-        
-        dashboard_data = {
-            "total_revenue": total_revenue,
-            "total_sales_count": len(sales),
-            "total_products": len(products),
-            "low_stock_count": len(low_stock_items),
-            "low_stock_items": low_stock_items,
-            "recent_sales": recent_sales
-        }
-        
+        dashboard_data = coalesce('dashboard', build_dashboard_data)
         return jsonify(dashboard_data), 200
 
     except Exception as e:
-        print("--- DASHBOARD ERROR ---", e)
+        logger.exception("DASHBOARD ERROR")
         return jsonify({"error": str(e)}), 500
 
 # ==========================================
 # SALES LEDGER & REPORTING
 # ==========================================
-@app.route('/api/sales-record', methods=['GET'])
+def build_sales_records():
+    sales_res = supabase.table('sales_transaction').select('*').execute()
+    sales = sales_res.data
+    
+    customers = get_index('customers')
+    
+    for sale in sales:
+        c_id = sale.get('customer_id')
+        sale['customer_name'] = customers.get(c_id, {}).get('name', 'Unknown')
+        
+    return sorted(sales, key=lambda x: x['sales_id'], reverse=True)
+
+@api.route('/api/sales-record', methods=['GET'])
 def get_sales_records():
     # Retrieves all sales transactions and joins customer names
     try:
-        sales_res = supabase.table('sales_transaction').select('*').execute()
-        sales = sales_res.data
-        
-        customers_res = supabase.table('customer').select('*').execute()
-        customers = {c['customer_id']: c for c in customers_res.data}
-        
-        for sale in sales:
-            c_id = sale.get('customer_id')
-            sale['customer_name'] = customers.get(c_id, {}).get('name', 'Unknown')
-            
-        sales_sorted = sorted(sales, key=lambda x: x['sales_id'], reverse=True)
+        sales_sorted = coalesce('sales-record', build_sales_records)
         return jsonify(sales_sorted), 200
 
     except Exception as e:
-        print("--- SALES RECORD ERROR ---", e)
+        logger.exception("SALES RECORD ERROR")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/sales/<int:sales_id>', methods=['GET'])
+def fetch_sale_details(sales_ids):
+    # Builds {"sale", "customer", "items"} bundles for many invoices with two queries, in sales_ids order
+    sales = supabase.table('sales_transaction').select('*').in_('sales_id', sales_ids).execute().data
+    details = fetch_all_rows(lambda: supabase.table('sales_details').select('*')
+                             .in_('sales_id', sales_ids).order('sales_id').order('product_id'))
+
+    customers = get_index('customers')
+    products = get_index('products')
+
+    items_by_sale = {}
+    for item in details:
+        item['name'] = products.get(item['product_id'], {}).get('product_name', "Unknown Product")
+        items_by_sale.setdefault(item['sales_id'], []).append(item)
+
+    sales_by_id = {sale['sales_id']: sale for sale in sales}
+    return [{
+        "sale": sales_by_id[s_id],
+        "customer": customers.get(sales_by_id[s_id].get('customer_id'), {}),
+        "items": items_by_sale.get(s_id, [])
+    } for s_id in sales_ids if s_id in sales_by_id]
+
+@api.route('/api/sales/<int:sales_id>', methods=['GET'])
 def get_sale_details(sales_id):
     # Retrieves comprehensive details for a specific sales invoice
     try:
-        sale_res = supabase.table('sales_transaction').select('*').eq('sales_id', sales_id).execute()
-        if not sale_res.data:
+        invoices = fetch_sale_details([sales_id])
+        if not invoices:
             return jsonify({"error": "Sale not found"}), 404
-        sale = sale_res.data[0]
-        
-        cust_res = supabase.table('customer').select('*').eq('customer_id', sale['customer_id']).execute()
-        customer = cust_res.data[0] if cust_res.data else {}
-        
-        items_res = supabase.table('sales_details').select('*').eq('sales_id', sales_id).execute()
-        items = items_res.data
-        
-        for item in items:
-            prod_res = supabase.table('product').select('product_name').eq('product_id', item['product_id']).execute()
-            item['name'] = prod_res.data[0]['product_name'] if prod_res.data else "Unknown Product"
             
-        return jsonify({
-            "sale": sale,
-            "customer": customer,
-            "items": items
-        }), 200
+        return jsonify(invoices[0]), 200
 
     except Exception as e:
-        print(f"--- GET SALE {sales_id} ERROR ---", e)
+        logger.exception(f"GET SALE {sales_id} ERROR")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/reports/sales', methods=['GET'])
+@api.route('/api/reports/sales', methods=['GET'])
 def generate_sales_report():
     # Generates a sales revenue report based on a specific date range
     try:
@@ -638,13 +1072,185 @@ def generate_sales_report():
         }), 200
 
     except Exception as e:
-        print("--- REPORT ERROR ---", e)
+        logger.exception("REPORT ERROR")
         return jsonify({"error": str(e)}), 500  
 
+# ==========================================
+# CUSTOMER RECEIVABLES LEDGER
+# ==========================================
+# Tables and the post_customer_charge / post_customer_payment functions live in sql/customer_ledger.sql.
+# Each function writes the ledger row and the running balance in one transaction, so balances stay
+# exact under concurrent sales and payments and reads never re-sum sales history.
+RECEIVABLE_AGE_BUCKETS = (("current", 30), ("31-60", 60), ("61-90", 90), ("90+", None))
+
+def money_amount(value):
+    return round(float(value or 0), 2)
+
+def record_charge(customer_id, sales_id, amount, date):
+    # Idempotent per sale: returns {"posted": False, ...} if the sale already has its charge
+    res = supabase.rpc('post_customer_charge', {
+        "p_customer_id": customer_id,
+        "p_sales_id": sales_id,
+        "p_amount": money_amount(amount),
+        "p_date": str(date)[:10]
+    }).execute()
+    return {"posted": res.data["posted"], "balance": money_amount(res.data["balance"])}
+
+def record_payment(customer_id, amount, date, reference=None):
+    # Settles the oldest open charges first; anything left over stays on the account as credit
+    res = supabase.rpc('post_customer_payment', {
+        "p_customer_id": customer_id,
+        "p_amount": money_amount(amount),
+        "p_date": str(date)[:10],
+        "p_reference": reference
+    }).execute()
+    return {
+        "balance": money_amount(res.data["balance"]),
+        "applied": [{"sales_id": a["sales_id"], "amount": money_amount(a["amount"])} for a in res.data["applied"]],
+        "unapplied": money_amount(res.data["unapplied"])
+    }
+
+def receivable_aging(open_charges, today):
+    aging = {label: 0.0 for label, _ in RECEIVABLE_AGE_BUCKETS}
+    for charge in open_charges:
+        bucket = age_bucket(batch_age_days(charge.get('date'), today), RECEIVABLE_AGE_BUCKETS)
+        aging[bucket] = money_amount(aging[bucket] + float(charge['open_amount']))
+    return aging
+
+@api.route('/api/clients/<int:client_id>/payments', methods=['POST'])
+def add_client_payment(client_id):
+    # Records a payment against a client's account and settles their oldest invoices first
+    try:
+        data = request.json or {}
+        try:
+            amount = money_amount(data.get('amount'))
+        except (TypeError, ValueError):
+            amount = 0
+        if amount <= 0:
+            return jsonify({"error": "amount must be a positive number"}), 400
+
+        # Read directly: the cached index can be stale for a client added moments ago
+        if not supabase.table('customer').select('customer_id').eq('customer_id', client_id).execute().data:
+            return jsonify({"error": "Client not found"}), 404
+
+        date = data.get('date') or datetime.now().strftime('%Y-%m-%d')
+        result = record_payment(client_id, amount, date, data.get('reference'))
+        event_broker.publish("payment", customer_id=client_id, amount=amount, balance=result["balance"])
+        return jsonify({"success": True, **result}), 201
+    except Exception as e:
+        logger.exception(f"ADD PAYMENT FOR CLIENT {client_id} ERROR")
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/api/clients/<int:client_id>/statement', methods=['GET'])
+def get_client_statement(client_id):
+    # Statement of account: running balance, aging of unpaid invoices and ledger entries
+    try:
+        customer_res = supabase.table('customer').select('*').eq('customer_id', client_id).execute()
+        if not customer_res.data:
+            return jsonify({"error": "Client not found"}), 404
+        customer = customer_res.data[0]
+
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+
+        balance_res = supabase.table('customer_balance').select('*').eq('customer_id', client_id).execute()
+        balance = balance_res.data[0] if balance_res.data else \
+            {"customer_id": client_id, "balance": 0, "total_charged": 0, "total_paid": 0, "last_activity": None}
+
+        # Paged like the entries below, so large accounts are not cut off at PostgREST's row cap
+        open_charges = fetch_all_rows(lambda: supabase.table('customer_ledger')
+                                      .select('entry_id, sales_id, date, amount, open_amount')
+                                      .eq('customer_id', client_id).eq('entry_type', 'charge').gt('open_amount', 0)
+                                      .order('date').order('entry_id'))
+
+        def build_query():
+            query = supabase.table('customer_ledger').select('*').eq('customer_id', client_id)
+            if start_date:
+                query = query.gte('date', start_date)
+            if end_date:
+                query = query.lte('date', end_date)
+            return query.order('date').order('entry_id')
+        entries = fetch_all_rows(build_query)
+
+        opening_balance = 0
+        if start_date:
+            prior = supabase.table('customer_ledger').select('balance_after').eq('customer_id', client_id) \
+                .lt('date', start_date).order('date', desc=True).order('entry_id', desc=True).limit(1).execute()
+            opening_balance = prior.data[0]['balance_after'] if prior.data else 0
+
+        return jsonify({
+            "customer": customer,
+            "balance": balance,
+            "opening_balance": opening_balance,
+            "aging": receivable_aging(open_charges, datetime.now().date()),
+            "open_invoices": open_charges,
+            "entries": entries
+        }), 200
+    except Exception as e:
+        logger.exception(f"CLIENT {client_id} STATEMENT ERROR")
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/api/clients/receivables', methods=['GET'])
+def get_receivables():
+    # Every client with an outstanding balance, read from the running balances rather than sales
+    try:
+        balances = fetch_all_rows(lambda: supabase.table('customer_balance').select('*')
+                                  .neq('balance', 0).order('customer_id'))
+        open_charges = fetch_all_rows(lambda: supabase.table('customer_ledger')
+                                      .select('entry_id, customer_id, date, open_amount')
+                                      .eq('entry_type', 'charge').gt('open_amount', 0).order('entry_id'))
+
+        charges_by_customer = {}
+        for charge in open_charges:
+            charges_by_customer.setdefault(charge['customer_id'], []).append(charge)
+
+        customers = get_index('customers')
+        today = datetime.now().date()
+        totals = {label: 0.0 for label, _ in RECEIVABLE_AGE_BUCKETS}
+        receivables = []
+        for row in balances:
+            aging = receivable_aging(charges_by_customer.get(row['customer_id'], []), today)
+            for label, amount in aging.items():
+                totals[label] = money_amount(totals[label] + amount)
+            receivables.append({
+                **row,
+                "name": customers.get(row['customer_id'], {}).get('name', 'Unknown'),
+                "aging": aging
+            })
+
+        receivables.sort(key=lambda r: float(r['balance']), reverse=True)
+        return jsonify({
+            "total_outstanding": money_amount(sum(float(r['balance']) for r in receivables)),
+            "aging": totals,
+            "customers": receivables
+        }), 200
+    except Exception as e:
+        logger.exception("RECEIVABLES ERROR")
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/api/clients/receivables/backfill', methods=['POST'])
+def backfill_receivables():
+    # One-off catch-up: posts a charge for every sale that is not in the ledger yet (oldest first).
+    # Safe to re-run or to run while sales come in: a sale that is already charged is skipped by the DB.
+    try:
+        posted = {row['sales_id'] for row in fetch_all_rows(
+            lambda: supabase.table('customer_ledger').select('sales_id').eq('entry_type', 'charge').order('sales_id'))}
+        sales = fetch_all_rows(lambda: supabase.table('sales_transaction')
+                               .select('sales_id, customer_id, total_amount, date').order('sales_id'))
+
+        missing = [s for s in sales if s['sales_id'] not in posted and s.get('customer_id')]
+        charges_posted = sum(
+            record_charge(sale['customer_id'], sale['sales_id'], sale['total_amount'], sale['date'])["posted"]
+            for sale in missing)
+        return jsonify({"success": True, "charges_posted": charges_posted}), 200
+    except Exception as e:
+        logger.exception("RECEIVABLES BACKFILL ERROR")
+        return jsonify({"error": str(e)}), 500
+
 # ==========================================
 # EMPLOYEE & USER MANAGEMENT
 # ==========================================
-@app.route('/api/employees', methods=['GET'])
+@api.route('/api/employees', methods=['GET'])
 def get_employees():
     # Retrieves employee profiles and joins their respective user auth roles
     try:
@@ -663,10 +1269,10 @@ def get_employees():
             
         return jsonify(employees), 200
     except Exception as e:
-        print("--- GET EMPLOYEES ERROR ---", e)
+        logger.exception("GET EMPLOYEES ERROR")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/employees', methods=['POST'])
+@api.route('/api/employees', methods=['POST'])
 def add_employee():
     # Creates both a system login account and an employee profile 
     try:
@@ -692,10 +1298,10 @@ def add_employee():
         return jsonify({"success": True, "message": "User created!"}), 201
 
     except Exception as e:
-        print("--- ADD EMPLOYEE ERROR ---", e)
+        logger.exception("ADD EMPLOYEE ERROR")
         return jsonify({"error": str(e)}), 500
     
-@app.route('/api/employees/<int:emp_id>', methods=['PUT'])
+@api.route('/api/employees/<int:emp_id>', methods=['PUT'])
 def update_employee(emp_id):
     try:
         data = request.json
@@ -715,11 +1321,11 @@ def update_employee(emp_id):
         return jsonify({"success": True}), 200
 
     except Exception as e:
-        print("--- UPDATE EMPLOYEE ERROR ---", e)
+        logger.exception("UPDATE EMPLOYEE ERROR")
         return jsonify({"error": str(e)}), 500
     
 #nagdagdag ako neto for the update toggle ng status
-@app.route('/api/employees/<int:emp_id>/status', methods=['PUT'])
+@api.route('/api/employees/<int:emp_id>/status', methods=['PUT'])
 def update_employee_status(emp_id):
     try:
         data = request.json
@@ -740,10 +1346,10 @@ def update_employee_status(emp_id):
         return jsonify({"success": True}), 200
 
     except Exception as e:
-        print("--- STATUS UPDATE ERROR ---", e)
+        logger.exception("STATUS UPDATE ERROR")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/users/update', methods=['PUT'])
+@api.route('/api/users/update', methods=['PUT'])
 def update_user_profile():
     # Updates the profile and auth credentials for the active user
     data = request.json
@@ -784,10 +1390,10 @@ def update_user_profile():
         return jsonify({"message": "Profile updated successfully!"}), 200
 
     except Exception as e:
-        print("--- PROFILE UPDATE ERROR ---", e)
+        logger.exception("PROFILE UPDATE ERROR")
         return jsonify({"error": "Failed to update database."}), 500
     
-@app.route('/api/employees/<int:emp_id>/archive', methods=['PUT'])
+@api.route('/api/employees/<int:emp_id>/archive', methods=['PUT'])
 def archive_employee(emp_id):
     try:
         data = request.json
@@ -799,7 +1405,7 @@ def archive_employee(emp_id):
 # ==========================================
 # BATCH TRACKING (FIFO INVENTORY)
 # ==========================================
-@app.route('/api/stock/receive', methods=['POST'])
+@api.route('/api/stock/receive', methods=['POST'])
 def receive_stock():
     # Logs individual incoming deliveries to product_batches and updates master inventory
     try:
@@ -814,29 +1420,33 @@ def receive_stock():
         if not product_id or not supplier_name or qty_received <= 0:
             return jsonify({"error": "Missing required fields or invalid quantity"}), 400
 
+        product_res = supabase.table('product').select('stock, retail_price').eq('product_id', product_id).execute()
+        
+        if not product_res.data:
+            return jsonify({"error": "Product not found in main inventory."}), 404
+
+        # Each batch keeps the cost it was delivered at, so the batch report can value stock FIFO
+        delivered_price = float(retail_price) if retail_price and float(retail_price) > 0 else None
         batch_data = {
             "product_id": product_id,
             "supplier_name": supplier_name,
             "qty_received": qty_received,
-            "qty_remaining": qty_received 
+            "qty_remaining": qty_received,
+            "unit_cost": delivered_price if delivered_price is not None else product_res.data[0].get('retail_price')
         }
         supabase.table('product_batches').insert(batch_data).execute()
-
-        product_res = supabase.table('product').select('stock').eq('product_id', product_id).execute()
-        
-        if not product_res.data:
-            return jsonify({"error": "Product not found in main inventory."}), 404
             
         current_stock = product_res.data[0]['stock']
         new_total_stock = current_stock + qty_received
 
         # --- NEW: Build the update payload to include the new price if it exists ---
         update_payload = {"stock": new_total_stock}
-        if retail_price and float(retail_price) > 0:
-            update_payload["retail_price"] = float(retail_price)
+        if delivered_price is not None:
+            update_payload["retail_price"] = delivered_price
 
         # Save both the stock and the new price back to the main table
         supabase.table('product').update(update_payload).eq('product_id', product_id).execute()
+        publish_stock_change(product_id, qty_received, new_total_stock, "receive")
 
         return jsonify({
             "message": "Stock received and batch logged successfully!", 
@@ -844,10 +1454,10 @@ def receive_stock():
         }), 200
 
     except Exception as e:
-        print("--- RECEIVE STOCK ERROR ---", e)
+        logger.exception("RECEIVE STOCK ERROR")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/batches/<int:product_id>', methods=['GET'])
+@api.route('/api/batches/<int:product_id>', methods=['GET'])
 def get_product_batches(product_id):
     # Retrieves all delivery batches for a specific product for the Batch Report
     try:
@@ -855,12 +1465,997 @@ def get_product_batches(product_id):
         res = supabase.table('product_batches').select('*').eq('product_id', product_id).order('date_received').execute()
         return jsonify(res.data), 200
     except Exception as e:
-        print(f"--- GET BATCHES ERROR ---", e)
-        return jsonify({"error": str(e)}), 500  
-         
+        logger.exception(f"GET BATCHES ERROR")
+        return jsonify({"error": str(e)}), 500
+
+# Rows fetched per round trip when scanning product_batches for the bulk report
+BATCH_PAGE_SIZE = 1000
+AGE_BUCKETS = (("0-30", 30), ("31-90", 90), ("90+", None))
+
+def iter_rows(build_query, page_size=BATCH_PAGE_SIZE):
+    # Supabase caps each response, so walk the query page by page until it runs dry.
+    # The query must be ordered by a unique key (or by every selected column), or rows can repeat
+    # or go missing across pages.
+    offset = 0
+    while True:
+        page = build_query().range(offset, offset + page_size - 1).execute().data
+        yield from page
+        if len(page) < page_size:
+            return
+        offset += page_size
+
+def fetch_all_rows(build_query, page_size=BATCH_PAGE_SIZE):
+    return list(iter_rows(build_query, page_size))
+
+def chunked(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def fetch_open_batches(product_id=None, supplier_name=None):
+    # Pages through every batch that still has stock, oldest first, in a single ordered scan
+    def build_query():
+        query = supabase.table('product_batches').select('*').gt('qty_remaining', 0)
+        if product_id:
+            query = query.eq('product_id', product_id)
+        if supplier_name:
+            query = query.eq('supplier_name', supplier_name)
+        return query.order('date_received').order('batch_id')
+    return fetch_all_rows(build_query)
+
+def batch_age_days(date_received, today):
+    # date_received may be a date or a full timestamp; only the calendar day matters
+    if not date_received:
+        return 0
+    received = datetime.strptime(str(date_received)[:10], '%Y-%m-%d').date()
+    return max(0, (today - received).days)
+
+def age_bucket(age_days, buckets=AGE_BUCKETS):
+    for label, upper in buckets:
+        if upper is None or age_days <= upper:
+            return label
+
+def build_batch_report(batches, products, slow_days, today):
+    # Aggregates open batches per product and per supplier in one pass
+    empty_buckets = lambda: {label: 0 for label, _ in AGE_BUCKETS}
+    by_product = {}
+    by_supplier = {}
+
+    for batch in batches:
+        p_id = batch['product_id']
+        product = products.get(p_id, {})
+        qty = int(batch.get('qty_remaining') or 0)
+        # Each batch is valued at the cost it was received at; batches received before unit_cost
+        # was recorded fall back to the product's current price
+        unit_cost = float(batch.get('unit_cost') or product.get('retail_price') or 0)
+        value = qty * unit_cost
+        age = batch_age_days(batch.get('date_received'), today)
+        bucket = age_bucket(age)
+
+        entry = by_product.get(p_id)
+        if entry is None:
+            entry = by_product[p_id] = {
+                "product_id": p_id,
+                "product_name": product.get('product_name', 'Unknown Product'),
+                "category": product.get('category'),
+                "open_batches": 0,
+                "qty_remaining": 0,
+                "fifo_value": 0.0,
+                "oldest_age_days": 0,
+                "age_buckets": empty_buckets(),
+                "slow_moving_qty": 0,
+                "slow_moving": False
+            }
+        entry["open_batches"] += 1
+        entry["qty_remaining"] += qty
+        entry["fifo_value"] += value
+        entry["oldest_age_days"] = max(entry["oldest_age_days"], age)
+        entry["age_buckets"][bucket] += qty
+
+        s_name = batch.get('supplier_name') or 'Unknown'
+        supplier = by_supplier.get(s_name)
+        if supplier is None:
+            supplier = by_supplier[s_name] = {
+                "supplier_name": s_name,
+                "open_batches": 0,
+                "qty_remaining": 0,
+                "fifo_value": 0.0,
+                "age_buckets": empty_buckets(),
+                "slow_moving_qty": 0,
+                "slow_moving_value": 0.0
+            }
+        supplier["open_batches"] += 1
+        supplier["qty_remaining"] += qty
+        supplier["fifo_value"] += value
+        supplier["age_buckets"][bucket] += qty
+
+        if age > slow_days:
+            entry["slow_moving_qty"] += qty
+            entry["slow_moving"] = True
+            supplier["slow_moving_qty"] += qty
+            supplier["slow_moving_value"] += value
+
+    product_rows = sorted(by_product.values(), key=lambda x: x['fifo_value'], reverse=True)
+    supplier_rows = sorted(by_supplier.values(), key=lambda x: x['fifo_value'], reverse=True)
+
+    return {
+        "as_of": today.isoformat(),
+        "slow_days": slow_days,
+        "total_batches": len(batches),
+        "total_qty": sum(p['qty_remaining'] for p in product_rows),
+        "total_value": sum(p['fifo_value'] for p in product_rows),
+        "products": product_rows,
+        "suppliers": supplier_rows
+    }
+
+def batch_report_csv(report):
+    # Yields the per-product section of the report one line at a time
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    bucket_labels = [label for label, _ in AGE_BUCKETS]
+    writer.writerow(["product_id", "product_name", "category", "open_batches", "qty_remaining",
+                     "fifo_value", "oldest_age_days"] + [f"qty_{label}_days" for label in bucket_labels]
+                    + ["slow_moving_qty"])
+    for row in report["products"]:
+        writer.writerow([row["product_id"], row["product_name"], row["category"], row["open_batches"],
+                         row["qty_remaining"], f"{row['fifo_value']:.2f}", row["oldest_age_days"]]
+                        + [row["age_buckets"][label] for label in bucket_labels]
+                        + [row["slow_moving_qty"]])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+@api.route('/api/batches', methods=['GET'])
+def get_batch_report():
+    # FIFO valuation and aging of every open batch, replacing one /api/batches/<id> call per product
+    try:
+        product_id = request.args.get('product_id', type=int)
+        supplier_name = request.args.get('supplier')
+        category = request.args.get('category')
+        slow_days = request.args.get('slow_days', default=90, type=int)
+        slow_only = request.args.get('slow_only') == 'true'
+
+        batches = fetch_open_batches(product_id, supplier_name)
+
+        products = {p['product_id']: p for p in fetch_all_rows(
+            lambda: supabase.table('product').select('product_id, product_name, category, retail_price').order('product_id'))}
+
+        if category:
+            batches = [b for b in batches if products.get(b['product_id'], {}).get('category') == category]
+
+        report = build_batch_report(batches, products, slow_days, datetime.now().date())
+        if slow_only:
+            report["products"] = [p for p in report["products"] if p["slow_moving"]]
+            report["suppliers"] = [s for s in report["suppliers"] if s["slow_moving_qty"] > 0]
+
+        if request.args.get('format') == 'csv':
+            filename = f"batch_report_{report['as_of']}.csv"
+            return Response(stream_with_context(batch_report_csv(report)), mimetype='text/csv',
+                            headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+        return jsonify(report), 200
+    except Exception as e:
+        logger.exception("BATCH REPORT ERROR")
+        return jsonify({"error": str(e)}), 500
+
+# ==========================================
+# REORDER SUGGESTIONS
+# ==========================================
+# Used when a supplier row has no lead_time_days of its own
+DEFAULT_LEAD_TIME_DAYS = int(os.environ.get("DEFAULT_LEAD_TIME_DAYS", 7))
+
+# Results are reused until the next stock or catalog change (or the cache TTL, so "today" keeps moving).
+# The generation lets a computation that overlapped an invalidation skip caching its stale result.
+_reorder_cache = {}
+_reorder_cache_lock = threading.Lock()
+_reorder_generation = 0
+
+def invalidate_reorder_suggestions():
+    global _reorder_generation
+    with _reorder_cache_lock:
+        _reorder_generation += 1
+        _reorder_cache.clear()
+
+def fetch_sales_log(since):
+    # Streams the Sale rows of inventory_log page by page into flat columns, never holding row dicts.
+    # Ordered by every selected column: rows that still tie are identical in what we read, so offset
+    # pages return exactly the right values without relying on the log's key column.
+    product_ids, dates, units = [], [], []
+    rows = iter_rows(lambda: supabase.table('inventory_log').select('product_id, date, quantity_change')
+                     .eq('transaction_type', 'Sale').gte('date', since)
+                     .order('date').order('product_id').order('quantity_change'))
+    for row in rows:
+        product_ids.append(row['product_id'])
+        dates.append(str(row['date'])[:10])
+        units.append(-float(row['quantity_change'] or 0))
+    return product_ids, dates, units
+
+def build_reorder_suggestions(history_days, window, alpha, safety_days, cover_days, supplier_id, include_all):
+    today = datetime.now().date()
+    start = today - timedelta(days=history_days - 1)
+
+    products = [p for p in fetch_all_rows(lambda: supabase.table('product').select('*').order('product_id'))
+                if not p.get('is_archived')]
+    suppliers = {s['supplier_id']: s for s in supabase.table('supplier').select('*').execute().data}
+    if supplier_id:
+        products = [p for p in products if p.get('supplier_id') == supplier_id]
+
+    product_ids = [p['product_id'] for p in products]
+    log_products, log_dates, log_units = fetch_sales_log(start.isoformat())
+
+    demand = forecasting.daily_demand_matrix(product_ids, log_products, log_dates, log_units, start.isoformat(), history_days)
+    moving_avg = forecasting.moving_average(demand, window)
+    smoothed = forecasting.exponential_smoothing(demand, alpha)
+
+    lead_times = [suppliers.get(p.get('supplier_id'), {}).get('lead_time_days') or DEFAULT_LEAD_TIME_DAYS for p in products]
+    stock = [p.get('stock') or 0 for p in products]
+    days_of_cover, reorder_points, quantities = forecasting.reorder_plan(stock, smoothed, lead_times, safety_days, cover_days)
+
+    groups = {}
+    for i, product in enumerate(products):
+        if not include_all and quantities[i] <= 0:
+            continue
+        s_id = product.get('supplier_id')
+        group = groups.get(s_id)
+        if group is None:
+            group = groups[s_id] = {
+                "supplier_id": s_id,
+                "supplier_name": suppliers.get(s_id, {}).get('supplier_name', 'No Supplier'),
+                "lead_time_days": lead_times[i],
+                "total_units": 0,
+                "estimated_cost": 0.0,
+                "items": []
+            }
+        qty = int(quantities[i])
+        cost = qty * float(product.get('retail_price') or 0)
+        group["total_units"] += qty
+        group["estimated_cost"] = round(group["estimated_cost"] + cost, 2)
+        group["items"].append({
+            "product_id": product['product_id'],
+            "product_name": product.get('product_name'),
+            "stock": stock[i],
+            "moving_avg_daily": round(float(moving_avg[i]), 3),
+            "smoothed_daily": round(float(smoothed[i]), 3),
+            "days_of_cover": days_of_cover[i],
+            "reorder_point": round(float(reorder_points[i]), 1),
+            "suggested_qty": qty,
+            "estimated_cost": round(cost, 2)
+        })
+
+    for group in groups.values():
+        # Most urgent first: lowest cover, products with no demand last
+        group["items"].sort(key=lambda x: (x["days_of_cover"] is None, x["days_of_cover"] or 0))
+
+    return {
+        "as_of": today.isoformat(),
+        "history_days": history_days,
+        "window": window,
+        "alpha": alpha,
+        "products_analyzed": len(products),
+        "log_rows": len(log_products),
+        "suppliers": sorted(groups.values(), key=lambda g: g["estimated_cost"], reverse=True)
+    }
+
+@api.route('/api/inventory/reorder-suggestions', methods=['GET'])
+def get_reorder_suggestions():
+    # Forecasts daily demand from sales history and proposes order quantities grouped by supplier
+    try:
+        history_days = request.args.get('history_days', default=365, type=int)
+        window = request.args.get('window', default=30, type=int)
+        alpha = request.args.get('alpha', default=0.2, type=float)
+        safety_days = request.args.get('safety_days', default=3, type=int)
+        cover_days = request.args.get('cover_days', default=30, type=int)
+        supplier_id = request.args.get('supplier_id', type=int)
+        include_all = request.args.get('include_all') == 'true'
+
+        if history_days < 1 or window < 1 or not 0 < alpha <= 1:
+            return jsonify({"error": "history_days and window must be positive and alpha in (0, 1]"}), 400
+
+        key = (history_days, window, alpha, safety_days, cover_days, supplier_id, include_all)
+        cached = _reorder_cache.get(key)
+        if cached and time.monotonic() - cached[0] < CACHE_TTL_SECONDS:
+            return jsonify({**cached[1], "cached": True}), 200
+
+        def compute():
+            generation = _reorder_generation
+            started = time.perf_counter()
+            result = build_reorder_suggestions(*key)
+            result["compute_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            with _reorder_cache_lock:
+                if generation == _reorder_generation:
+                    _reorder_cache[key] = (time.monotonic(), result)
+            return result
+
+        return jsonify({**coalesce('reorder-suggestions', compute), "cached": False}), 200
+    except Exception as e:
+        logger.exception("REORDER SUGGESTIONS ERROR")
+        return jsonify({"error": str(e)}), 500
+
+# ==========================================
+# BULK CSV IMPORT
+# ==========================================
+# Rows sent to Supabase per insert call
+IMPORT_CHUNK_SIZE = 500
+
+def parse_price(value):
+    if value is None:
+        return None
+    price = float(value)
+    if price < 0:
+        raise ValueError("must not be negative")
+    return price
+
+def validate_product_row(mapped):
+    for column in ("retail_price", "selling_price"):
+        try:
+            mapped[column] = parse_price(mapped[column])
+        except ValueError:
+            raise ValueError(f"{column} must be a non-negative number")
+    mapped["stock"] = 0
+    return mapped
+
+IMPORT_ENTITIES = {
+    "products": {"table": "product", "id_column": "product_id", "fields": PRODUCT_FIELDS,
+                 "name_column": "product_name", "validate": validate_product_row, "index": "products"},
+    "clients": {"table": "customer", "id_column": "customer_id", "fields": CLIENT_FIELDS,
+                "name_column": "name", "validate": None, "index": "customers"},
+    "suppliers": {"table": "supplier", "id_column": "supplier_id", "fields": SUPPLIER_FIELDS,
+                  "name_column": "supplier_name", "validate": None, "index": None},
+}
+
+def normalize_name(name):
+    return " ".join(str(name).split()).lower()
+
+def read_import_rows(entity):
+    # Yields (line_number, raw_row) from the uploaded file without loading it all into memory
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    fields = entity["fields"]
+    for line_number, raw in enumerate(reader, start=2):
+        row = {}
+        for header, value in raw.items():
+            if header is None:
+                continue
+            header = header.strip().lower()
+            value = value.strip() if isinstance(value, str) else value
+            row[header] = value if value != "" else None
+        # Accept either the form keys (e.g. "name") or the database column names as headers
+        for column, form_key in fields.items():
+            if row.get(form_key) is None and row.get(column) is not None:
+                row[form_key] = row[column]
+        yield line_number, row
+
+def run_import(entity_name, entity, dry_run):
+    # Generator of progress events: one per flushed chunk, then a final summary
+    # Paged in primary-key order: names are not unique, so ordering by name could skip rows between pages
+    existing = fetch_all_rows(lambda: supabase.table(entity["table"])
+                              .select(f'{entity["id_column"]}, {entity["name_column"]}').order(entity["id_column"]))
+    seen = {normalize_name(r[entity["name_column"]]) for r in existing if r.get(entity["name_column"])}
+
+    summary = {"entity": entity_name, "rows": 0, "inserted": 0, "duplicates": 0, "errors": [], "dry_run": dry_run}
+    chunk = []
+
+    def flush():
+        lines = [line for line, _ in chunk]
+        if not dry_run:
+            try:
+                supabase.table(entity["table"]).insert([payload for _, payload in chunk]).execute()
+            except Exception as e:
+                logger.exception(f"IMPORT {entity_name.upper()} CHUNK ERROR")
+                summary["errors"].extend({"row": line, "error": str(e)} for line in lines)
+                chunk.clear()
+                return
+        summary["inserted"] += len(chunk)
+        chunk.clear()
+
+    for line_number, row in read_import_rows(entity):
+        summary["rows"] += 1
+        mapped = map_fields(row, entity["fields"])
+        name = mapped.get(entity["name_column"])
+        if not name:
+            summary["errors"].append({"row": line_number, "error": "name is required"})
+            continue
+        key = normalize_name(name)
+        if key in seen:
+            summary["duplicates"] += 1
+            continue
+        try:
+            if entity["validate"]:
+                mapped = entity["validate"](mapped)
+        except ValueError as e:
+            summary["errors"].append({"row": line_number, "error": str(e)})
+            continue
+
+        seen.add(key)
+        chunk.append((line_number, mapped))
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            flush()
+            yield {"progress": {"rows": summary["rows"], "inserted": summary["inserted"]}}
+
+    if chunk:
+        flush()
+    if entity["index"] and summary["inserted"] and not dry_run:
+        invalidate_index(entity["index"])
+        event_broker.publish("import", entity=entity_name, inserted=summary["inserted"])
+    summary["error_count"] = len(summary["errors"])
+    yield {"done": summary}
+
+@api.route('/api/import/<entity_name>', methods=['POST'])
+def import_csv(entity_name):
+    # Bulk-loads products, clients or suppliers from an uploaded CSV in chunked inserts
+    entity = IMPORT_ENTITIES.get(entity_name)
+    if entity is None:
+        return jsonify({"error": f"Unknown import type '{entity_name}'"}), 404
+
+    dry_run = request.args.get('dry_run') == 'true'
+    try:
+        events = run_import(entity_name, entity, dry_run)
+
+        if request.args.get('stream') == 'true':
+            # Newline-delimited JSON so the client can show progress while chunks are written
+            def generate():
+                try:
+                    for event in events:
+                        yield json.dumps(event) + "\n"
+                except Exception as e:
+                    logger.exception(f"IMPORT {entity_name.upper()} ERROR")
+                    yield json.dumps({"error": str(e)}) + "\n"
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+        summary = None
+        for event in events:
+            summary = event.get("done", summary)
+        return jsonify(summary), 200
+    except Exception as e:
+        logger.exception(f"IMPORT {entity_name.upper()} ERROR")
+        return jsonify({"error": str(e)}), 500
+
+# ==========================================
+# BULK ARCHIVE & UPDATE
+# ==========================================
+# ids per in_() filter; keeps the PostgREST query string well under URL limits
+BULK_CHUNK_SIZE = 200
+BULK_MAX_ITEMS = 5000
+
+def validate_product_patch(patch):
+    for column in ("retail_price", "selling_price"):
+        if column in patch:
+            try:
+                patch[column] = parse_price(patch[column])
+            except (TypeError, ValueError):
+                raise ValueError(f"{column} must be a non-negative number")
+    return patch
+
+BULK_ENTITIES = {
+    "products": {"table": "product", "id_column": "product_id", "fields": PRODUCT_FIELDS,
+                 "name_column": "product_name", "validate": validate_product_patch,
+                 "index": "products", "event_entity": "product"},
+    "suppliers": {"table": "supplier", "id_column": "supplier_id", "fields": SUPPLIER_FIELDS,
+                  "name_column": "supplier_name", "validate": None, "index": None, "event_entity": "supplier"},
+    "clients": {"table": "customer", "id_column": "customer_id", "fields": CLIENT_FIELDS,
+                "name_column": "name", "validate": None, "index": "customers", "event_entity": "client"},
+    "employees": {"table": "employee", "id_column": "employee_id", "fields": None,
+                  "name_column": None, "validate": None, "index": None, "event_entity": "employee"},
+}
+
+def parse_ids(values):
+    # Returns (unique int ids in request order, per-item errors for anything that is not an id)
+    ids, errors, seen = [], [], set()
+    for value in values:
+        try:
+            item_id = int(value)
+        except (TypeError, ValueError):
+            errors.append({"id": value, "status": "error", "error": "invalid id"})
+            continue
+        if item_id not in seen:
+            seen.add(item_id)
+            ids.append(item_id)
+    return ids, errors
+
+def fetch_rows_by_id(entity, ids, columns='*'):
+    rows = {}
+    for id_chunk in chunked(ids, BULK_CHUNK_SIZE):
+        res = supabase.table(entity["table"]).select(columns).in_(entity["id_column"], id_chunk).execute()
+        rows.update({row[entity["id_column"]]: row for row in res.data})
+    return rows
+
+def after_bulk_change(entity):
+    if entity["index"]:
+        invalidate_index(entity["index"])
+    if entity["table"] == "supplier":
+        # Supplier names group the reorder suggestions
+        invalidate_reorder_suggestions()
+
+@api.route('/api/bulk/<entity_name>/archive', methods=['PUT'])
+def bulk_archive(entity_name):
+    # Archives or restores many records with one in_() update per chunk of ids
+    entity = BULK_ENTITIES.get(entity_name)
+    if entity is None:
+        return jsonify({"error": f"Unknown entity '{entity_name}'"}), 404
+    try:
+        data = request.json or {}
+        is_archived = data.get('is_archived')
+        if not isinstance(is_archived, bool):
+            return jsonify({"error": "is_archived must be true or false"}), 400
+        if not isinstance(data.get('ids'), list) or not data['ids']:
+            return jsonify({"error": "Provide a non-empty list of ids"}), 400
+        if len(data['ids']) > BULK_MAX_ITEMS:
+            return jsonify({"error": f"At most {BULK_MAX_ITEMS} ids per request"}), 400
+
+        ids, results = parse_ids(data['ids'])
+        existing = fetch_rows_by_id(entity, ids, entity["id_column"])
+        found = [item_id for item_id in ids if item_id in existing]
+        results += [{"id": item_id, "status": "not_found"} for item_id in ids if item_id not in existing]
+
+        status = "archived" if is_archived else "restored"
+        for id_chunk in chunked(found, BULK_CHUNK_SIZE):
+            try:
+                supabase.table(entity["table"]).update({'is_archived': is_archived}) \
+                    .in_(entity["id_column"], id_chunk).execute()
+                results += [{"id": item_id, "status": status} for item_id in id_chunk]
+            except Exception as e:
+                logger.exception(f"BULK ARCHIVE {entity_name.upper()} CHUNK ERROR")
+                results += [{"id": item_id, "status": "error", "error": str(e)} for item_id in id_chunk]
+
+        changed = [r["id"] for r in results if r["status"] == status]
+        if changed:
+            after_bulk_change(entity)
+            event_broker.publish("archive", entity=entity["event_entity"], ids=changed, is_archived=is_archived)
+
+        return jsonify({"success": all(r["status"] == status for r in results), "updated": len(changed), "results": results}), 200
+    except Exception as e:
+        logger.exception(f"BULK ARCHIVE {entity_name.upper()} ERROR")
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/api/bulk/<entity_name>', methods=['PUT'])
+def bulk_update(entity_name):
+    # Applies per-id patches ({"id": 1, "selling_price": 120, ...}) in a handful of batched writes
+    entity = BULK_ENTITIES.get(entity_name)
+    if entity is None or entity["fields"] is None:
+        return jsonify({"error": f"Bulk update is not supported for '{entity_name}'"}), 404
+    try:
+        updates = (request.json or {}).get('updates')
+        if not isinstance(updates, list) or not updates:
+            return jsonify({"error": "Provide a non-empty list of updates"}), 400
+        if len(updates) > BULK_MAX_ITEMS:
+            return jsonify({"error": f"At most {BULK_MAX_ITEMS} updates per request"}), 400
+
+        id_column = entity["id_column"]
+        results = []
+        patches = {}
+        for update in updates:
+            item_id = update.get('id') if isinstance(update, dict) else None
+            try:
+                item_id = int(item_id)
+            except (TypeError, ValueError):
+                results.append({"id": item_id, "status": "error", "error": "invalid id"})
+                continue
+            # Only keys the client actually sent are applied, so a patch never blanks other columns
+            patch = {column: update[key] for column, key in entity["fields"].items() if key in update}
+            try:
+                if not patch:
+                    raise ValueError("no updatable fields in patch")
+                if entity["name_column"] in patch and not patch[entity["name_column"]]:
+                    raise ValueError("name cannot be empty")
+                if entity["validate"]:
+                    patch = entity["validate"](patch)
+            except ValueError as e:
+                results.append({"id": item_id, "status": "error", "error": str(e)})
+                continue
+            # A later patch for the same id wins, matching what sequential PUTs would have done
+            patches.setdefault(item_id, {}).update(patch)
+
+        existing = fetch_rows_by_id(entity, list(patches), id_column)
+        results += [{"id": item_id, "status": "not_found"} for item_id in patches if item_id not in existing]
+
+        # Only the patched columns are ever written, so concurrent edits to other columns survive.
+        # Ids sharing an identical patch (e.g. "set category on these 200") become one UPDATE ... IN;
+        # the rest (e.g. a price list) go through bulk_patch_rows (sql/bulk_update.sql): one
+        # UPDATE ... FROM per chunk of rows that patch the same columns.
+        same_patch = {}
+        for item_id, patch in patches.items():
+            if item_id in existing:
+                same_patch.setdefault(json.dumps(patch, sort_keys=True, default=str), []).append(item_id)
+
+        def report(id_chunk, updated_rows):
+            # Rows deleted since the existence check simply do not come back
+            updated = set(updated_rows)
+            results.extend({"id": item_id, "status": "updated" if item_id in updated else "not_found"}
+                           for item_id in id_chunk)
+
+        def update_one_by_one(item_ids):
+            # Fallback so one bad row does not sink the whole chunk
+            for item_id in item_ids:
+                try:
+                    res = supabase.table(entity["table"]).update(patches[item_id]).eq(id_column, item_id).execute()
+                    results.append({"id": item_id, "status": "updated" if res.data else "not_found"})
+                except Exception as e:
+                    results.append({"id": item_id, "status": "error", "error": str(e)})
+
+        same_columns = {}
+        for item_ids in same_patch.values():
+            if len(item_ids) == 1:
+                item_id = item_ids[0]
+                same_columns.setdefault(tuple(sorted(patches[item_id])), []).append(item_id)
+                continue
+            for id_chunk in chunked(item_ids, BULK_CHUNK_SIZE):
+                try:
+                    res = supabase.table(entity["table"]).update(patches[id_chunk[0]]).in_(id_column, id_chunk).execute()
+                    report(id_chunk, [row[id_column] for row in res.data])
+                except Exception:
+                    logger.exception(f"BULK UPDATE {entity_name.upper()} GROUP UPDATE ERROR")
+                    update_one_by_one(id_chunk)
+
+        for columns, item_ids in same_columns.items():
+            for id_chunk in chunked(item_ids, BULK_CHUNK_SIZE):
+                try:
+                    res = supabase.rpc('bulk_patch_rows', {
+                        "p_table": entity["table"],
+                        "p_id_column": id_column,
+                        "p_columns": list(columns),
+                        "p_rows": [{id_column: item_id, **patches[item_id]} for item_id in id_chunk]
+                    }).execute()
+                    report(id_chunk, [row["updated_id"] for row in res.data])
+                except Exception:
+                    logger.exception(f"BULK UPDATE {entity_name.upper()} BATCH UPDATE ERROR")
+                    update_one_by_one(id_chunk)
+
+        changed = [r["id"] for r in results if r["status"] == "updated"]
+        if changed:
+            after_bulk_change(entity)
+            event_broker.publish(entity["event_entity"], action="updated", ids=changed)
+
+        return jsonify({"success": all(r["status"] == "updated" for r in results), "updated": len(changed), "results": results}), 200
+    except Exception as e:
+        logger.exception(f"BULK UPDATE {entity_name.upper()} ERROR")
+        return jsonify({"error": str(e)}), 500
+
+# ==========================================
+# INVOICE PDF GENERATION
+# ==========================================
+# Rendering is CPU-bound, so it runs in worker processes instead of request threads
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+# Render tasks allowed in the pool at once across all requests in this worker
+PDF_QUEUE_LIMIT = int(os.environ.get("PDF_QUEUE_LIMIT", PDF_WORKERS * 4))
+PDF_QUEUE_TIMEOUT = 30
+# Longest a single-invoice request waits for its render
+PDF_RENDER_TIMEOUT = int(os.environ.get("PDF_RENDER_TIMEOUT", 60))
+PDF_TASK_SIZE = 10
+PDF_FETCH_BATCH = 100
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+_pdf_slots = threading.BoundedSemaphore(PDF_QUEUE_LIMIT)
+# Serialises multi-slot reservations so two downloads can never each hold half of what they need
+_pdf_reserve_lock = threading.Lock()
+
+class PdfQueueFull(Exception):
+    pass
+
+def get_pdf_pool():
+    # Started on first use; "spawn" avoids forking a process that is running request threads
+    global _pdf_pool
+    if _pdf_pool is None:
+        with _pdf_pool_lock:
+            if _pdf_pool is None:
+                _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pdf_pool
+
+def submit_pdf_task(invoices):
+    if not _pdf_slots.acquire(timeout=PDF_QUEUE_TIMEOUT):
+        raise PdfQueueFull("PDF queue is full, try again shortly")
+    try:
+        future = get_pdf_pool().submit(invoice_pdf.render_invoice_batch, invoices)
+    except Exception:
+        _pdf_slots.release()
+        raise
+    future.add_done_callback(lambda _: _pdf_slots.release())
+    return future
+
+def reserve_pdf_slots(count):
+    # Takes all `count` slots or none, so a ZIP download knows it has capacity before it starts streaming
+    deadline = time.monotonic() + PDF_QUEUE_TIMEOUT
+    taken = 0
+    with _pdf_reserve_lock:
+        while taken < count:
+            if not _pdf_slots.acquire(timeout=max(0, deadline - time.monotonic())):
+                release_pdf_slots(taken)
+                raise PdfQueueFull("PDF queue is full, try again shortly")
+            taken += 1
+    return count
+
+def release_pdf_slots(count):
+    for _ in range(count):
+        _pdf_slots.release()
+
+def finish_pdf_stream(pending, reserved):
+    # Runs when the download ends or the client goes away: drops queued renders and hands the slots back
+    still_running = [future for _, future in pending if not future.cancel()]
+    pending.clear()
+    release_pdf_slots(reserved - len(still_running))
+    for future in still_running:
+        future.add_done_callback(lambda _: _pdf_slots.release())
+
+class ZipStream:
+    # Write-only sink for zipfile; each chunk is handed to the response as soon as it is written
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def generate_invoice_zip(invoices, pending, window):
+    # Renders within the slots reserved by the route (at most `window` tasks in flight), so once the
+    # response has started nothing here waits on the shared queue. A task that fails to render is
+    # listed in summary.json instead of cutting the ZIP off half-written.
+    sink = ZipStream()
+    archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED)
+    started = time.perf_counter()
+    rendered = 0
+    failed = []
+
+    def write_next():
+        nonlocal rendered
+        task, future = pending.popleft()
+        try:
+            pages = future.result()
+        except Exception:
+            logger.exception("INVOICE PDF RENDER ERROR")
+            failed.extend(invoice['sale']['sales_id'] for invoice in task)
+            pages = []
+        for s_id, pdf in pages:
+            archive.writestr(f"INV-{s_id}.pdf", pdf)
+            rendered += 1
+        return sink.drain()
+
+    for task in chunked(invoices, PDF_TASK_SIZE):
+        try:
+            pending.append((task, get_pdf_pool().submit(invoice_pdf.render_invoice_batch, task)))
+        except Exception:
+            logger.exception("INVOICE PDF SUBMIT ERROR")
+            failed.extend(invoice['sale']['sales_id'] for invoice in task)
+        while len(pending) >= window:
+            yield write_next()
+    while pending:
+        yield write_next()
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "invoices": rendered,
+        "failed": failed,
+        "seconds": round(elapsed, 2),
+        "workers": PDF_WORKERS,
+        "invoices_per_second": round(rendered / elapsed, 1) if elapsed else None,
+        "invoices_per_second_per_worker": round(rendered / elapsed / PDF_WORKERS, 1) if elapsed else None
+    }
+    logger.info("INVOICE PDF BATCH", extra=summary)
+    archive.writestr("summary.json", json.dumps(summary, indent=2))
+    archive.close()
+    yield sink.drain()
+
+@api.route('/api/invoices/pdf', methods=['GET'])
+def get_invoice_pdfs():
+    # One invoice as a PDF (?sales_id=) or a date range (?start_date=&end_date=[&customer_id=]) as a ZIP
+    try:
+        sales_id = request.args.get('sales_id', type=int)
+        if sales_id:
+            invoices = fetch_sale_details([sales_id])
+            if not invoices:
+                return jsonify({"error": "Sale not found"}), 404
+            future = submit_pdf_task(invoices)
+            try:
+                [(_, pdf)] = future.result(timeout=PDF_RENDER_TIMEOUT)
+            except FutureTimeoutError:
+                future.cancel()
+                return jsonify({"error": "Rendering the invoice took too long, try again shortly"}), 503
+            return Response(pdf, mimetype='application/pdf',
+                            headers={"Content-Disposition": f"inline; filename=INV-{sales_id}.pdf"})
+
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        if not start_date or not end_date:
+            return jsonify({"error": "Please provide sales_id, or start_date and end_date"}), 400
+
+        customer_id = request.args.get('customer_id', type=int)
+        def build_query():
+            query = supabase.table('sales_transaction').select('sales_id').gte('date', start_date).lte('date', end_date)
+            if customer_id:
+                query = query.eq('customer_id', customer_id)
+            return query.order('sales_id')
+        sales_ids = [row['sales_id'] for row in fetch_all_rows(build_query)]
+        if not sales_ids:
+            return jsonify({"error": "No sales found in that range"}), 404
+
+        # Everything that can fail upstream or on capacity happens before the first byte is sent,
+        # so errors still come back as a JSON 500/503 instead of a truncated ZIP
+        invoices = [invoice for id_batch in chunked(sales_ids, PDF_FETCH_BATCH)
+                    for invoice in fetch_sale_details(id_batch)]
+        window = max(1, min(PDF_WORKERS * 2, PDF_QUEUE_LIMIT, -(-len(invoices) // PDF_TASK_SIZE)))
+        reserved = reserve_pdf_slots(window)
+
+        pending = deque()
+        filename = f"invoices_{start_date}_to_{end_date}.zip"
+        response = Response(stream_with_context(generate_invoice_zip(invoices, pending, window)),
+                            mimetype='application/zip',
+                            headers={"Content-Disposition": f"attachment; filename={filename}"})
+        response.call_on_close(lambda: finish_pdf_stream(pending, reserved))
+        return response
+
+    except PdfQueueFull as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        logger.exception("INVOICE PDF ERROR")
+        return jsonify({"error": str(e)}), 500
+
+# ==========================================
+# LIVE EVENTS ENDPOINT
+# ==========================================
+def format_sse(seq, event_type, payload):
+    return f"id: {seq}\nevent: {event_type}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
+
+@api.route('/api/events', methods=['GET'])
+def stream_events():
+    # Pushes stock, sale, product and archive changes to every open page as they happen
+    wanted = set(filter(None, request.args.get('types', '').split(',')))
+    # Reconnecting EventSource clients send Last-Event-ID so nothing in the buffer is missed.
+    # An id this worker cannot replay (from another worker or before a restart, or already
+    # rotated out of the buffer) gets a "resync" event so the page refetches instead.
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    latest = event_broker.latest_seq()
+    resync = last_id is not None and (last_id > latest or last_id < event_broker.oldest_seq() - 1)
+    last_seq = latest if last_id is None or resync else last_id
+
+    if not event_broker.subscribe(limit=SSE_MAX_SUBSCRIBERS):
+        return jsonify({"error": "Too many live connections on this worker"}), 503
+
+    def generate():
+        nonlocal last_seq
+        yield "retry: 2000\n\n"
+        if resync:
+            yield format_sse(last_seq, "resync", {"reason": "missed events"})
+        while True:
+            events = event_broker.wait_for(last_seq, SSE_HEARTBEAT_SECONDS)
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for seq, event_type, payload in events:
+                last_seq = seq
+                if event_type == "cache":
+                    # Internal: only tells other workers to drop a reference index
+                    continue
+                # resync is always sent: it replaces whatever events the filter was waiting for
+                if not wanted or event_type in wanted or event_type == "resync":
+                    yield format_sse(seq, event_type, payload)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # Runs when the server closes the stream, even if the client left before the first chunk
+    response.call_on_close(lambda: event_broker.subscribe(-1))
+    return response
+
+# ==========================================
+# HEALTH & READINESS
+# ==========================================
+@api.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the worker is up and serving requests, no upstream calls made
+    return jsonify({
+        "status": "ok",
+        "cold_start_ms": current_app.config.get("COLD_START_MS"),
+        "uptime_seconds": round(time.perf_counter() - current_app.config["STARTED_AT"], 1)
+    }), 200
+
+@api.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness: Supabase answers and the reference caches have been loaded at least once
+    checks = {"upstream": False, "caches_warm": caches_warm()}
+    try:
+        supabase.table('product').select('product_id').limit(1).execute()
+        checks["upstream"] = True
+        if current_app.config["WARM_UP"] and not checks["caches_warm"]:
+            # Retries a warm-up that failed at boot instead of staying unready forever
+            warm_up()
+            checks["caches_warm"] = True
+    except Exception as e:
+        logger.exception("READINESS CHECK ERROR")
+        checks["error"] = str(e)
+
+    ready = checks["upstream"] and (checks["caches_warm"] or not current_app.config["WARM_UP"])
+    return jsonify({"ready": ready, **checks}), 200 if ready else 503
+
+@api.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    # Process-local counters; each gunicorn worker reports its own
+    return jsonify({
+        "pid": os.getpid(),
+        "logs_dropped": NonBlockingQueueHandler.dropped,
+        "single_flight": {**single_flight.stats, "in_flight": single_flight.in_flight(),
+                          "generation": single_flight.generation},
+        "events": {
+            "subscribers": event_broker.subscribers,
+            "last_seq": event_broker.latest_seq(),
+            "relay": None if event_broker.relay is None else
+                     {"listening": event_broker.relay.listening, "reconnects": event_broker.relay.reconnects}
+        }
+    }), 200
+
+# ==========================================
+# REQUEST LOGGING
+# ==========================================
+@api.before_app_request
+def start_request_log():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:12]
+    g.request_started = time.perf_counter()
+    g.upstream_calls = 0
+
+@api.after_app_request
+def finish_request_log(response):
+    response.headers['X-Request-ID'] = g.get("request_id", "")
+    message = f"{request.method} {request.path}"
+    if not response.is_streamed:
+        log_request(message, response.status_code, g)
+        return response
+
+    # Streamed bodies (SSE, invoice ZIPs) are still being produced at this point, so log once the
+    # server closes the response. That runs outside the request context, so carry g and its ids along.
+    request_g = g._get_current_object()
+    endpoint = request.endpoint
+    response.call_on_close(lambda: log_request(message, response.status_code, request_g,
+                                               streamed=True, request_id=request_g.get("request_id"),
+                                               endpoint=endpoint))
+    return response
+
+def log_request(message, status, request_g, **extra):
+    started = request_g.get("request_started", time.perf_counter())
+    logger.info(message, extra={
+        "status": status,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "upstream_calls": request_g.get("upstream_calls", 0),
+        **extra
+    })
+
 # ==========================================
 # SERVER INITIALIZATION
 # ==========================================
+def create_app(warm=None):
+    # Builds the Flask app; set WARM_UP=1 (or pass warm=True) to preload caches before serving
+    configure_logging()
+    start_event_relay()
+    app = Flask(__name__)
+    CORS(app)
+    app.register_blueprint(api)
+
+    if warm is None:
+        warm = os.environ.get("WARM_UP", "0").lower() in ("1", "true", "yes")
+    app.config["WARM_UP"] = warm
+
+    if warm:
+        try:
+            warm_up()
+        except Exception as e:
+            # A failed warm-up only delays readiness; /readyz retries it and reports 503 until it loads
+            logger.exception("WARM UP ERROR")
+
+    app.config["STARTED_AT"] = time.perf_counter()
+    app.config["COLD_START_MS"] = round((app.config["STARTED_AT"] - IMPORT_STARTED) * 1000, 1)
+    logger.info("APP READY", extra={"cold_start_ms": app.config["COLD_START_MS"], "warm_up": warm})
+    return app
+
+# "spawn" PDF workers re-run the main script as __mp_main__ when the app is started with
+# `python app.py`; they only need invoice_pdf, so they must not build a second app (logging
+# listener, event relay connection, warm-up) each
+if __name__ != '__mp_main__':
+    app = create_app()
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port)
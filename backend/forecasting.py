@@ -0,0 +1,44 @@
+import math
+import numpy as np
+
+# Demand forecasting over inventory_log. Pure numpy, no Flask/Supabase, so it can be reused offline.
+
+def daily_demand_matrix(product_ids, log_product_ids, log_dates, log_units, start, days):
+    # Scatters log rows into a (products x days) array of units sold per calendar day
+    index = {p_id: i for i, p_id in enumerate(product_ids)}
+    demand = np.zeros((len(product_ids), days))
+    if not log_product_ids:
+        return demand
+
+    rows = np.fromiter((index.get(p_id, -1) for p_id in log_product_ids), dtype=np.int64, count=len(log_product_ids))
+    cols = (np.array(log_dates, dtype='datetime64[D]') - np.datetime64(start, 'D')).astype(np.int64)
+    units = np.asarray(log_units, dtype=float)
+
+    keep = (rows >= 0) & (cols >= 0) & (cols < days)
+    np.add.at(demand, (rows[keep], cols[keep]), units[keep])
+    return demand
+
+def moving_average(demand, window):
+    window = max(1, min(window, demand.shape[1]))
+    return demand[:, -window:].sum(axis=1) / window
+
+def exponential_smoothing(demand, alpha):
+    # EWMA of every row at once as a single matrix-vector product instead of a per-day loop.
+    # Weights are normalised so short histories are not biased towards zero.
+    days = demand.shape[1]
+    weights = alpha * (1 - alpha) ** np.arange(days - 1, -1, -1)
+    total = weights.sum()
+    return demand @ weights / total if total else np.zeros(demand.shape[0])
+
+def reorder_plan(stock, daily_demand, lead_time_days, safety_days, cover_days):
+    # Days of cover and order quantities for every product; None cover means no recent demand
+    stock = np.asarray(stock, dtype=float)
+    lead_time_days = np.asarray(lead_time_days, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cover = np.where(daily_demand > 0, stock / daily_demand, np.inf)
+    reorder_point = daily_demand * (lead_time_days + safety_days)
+    target = daily_demand * (lead_time_days + cover_days)
+    needs_order = (daily_demand > 0) & (stock <= reorder_point)
+    quantity = np.where(needs_order, np.ceil(np.maximum(target - stock, 0)), 0)
+    days_of_cover = [None if math.isinf(c) else round(float(c), 1) for c in cover]
+    return days_of_cover, reorder_point, quantity.astype(int)
@@ -0,0 +1,24 @@
+import os
+from dotenv import load_dotenv
+
+# Production server settings: `gunicorn -c gunicorn.conf.py app:app` (run from backend/)
+load_dotenv()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Threaded workers: every open /api/events stream holds one thread for as long as the page is open,
+# so sync workers would be used up by a few tabs and killed by `timeout` mid-stream. With gthread the
+# timeout only watches the worker's heartbeat, not individual requests. (gevent is not used because
+# the invoice PDF process pool and the Supabase HTTP client are not monkey-patch safe.)
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 64))
+
+# Live events only cross workers through the Postgres relay (DATABASE_URL); without it stay on one
+workers = int(os.environ.get("WEB_CONCURRENCY", 2 if os.environ.get("DATABASE_URL") else 1))
+
+timeout = int(os.environ.get("WEB_TIMEOUT", 60))
+graceful_timeout = 10
+keepalive = 5
+
+# Each worker imports the app itself, so its relay listener thread and PDF pool start after the fork
+preload_app = False
@@ -0,0 +1,94 @@
+import io
+from xml.sax.saxutils import escape
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+# Kept separate from app.py so process-pool workers only need this module and reportlab;
+# app.py's own entrypoint is guarded so a spawned worker never builds the Flask app.
+
+COMPANY_NAME = "ERGIN HARDWARE AND CONSTRUCTION SUPPLY"
+COMPANY_ADDRESS = "Bomba Street, Salvacion, Murcia, Negros Occidental"
+LEGAL_NOTE = ("Received the above in good condition. Parties expressly submit themselves "
+              "to the jurisdiction of the Courts of Bacolod City.")
+BRAND_RED = colors.HexColor("#d10000")
+
+# The built-in PDF fonts have no peso glyph, so amounts are prefixed with "PHP"
+def money(value):
+    return f"PHP {float(value or 0):,.2f}"
+
+def render_invoice_pdf(invoice):
+    # Renders one {"sale", "customer", "items"} bundle (as built by fetch_sale_details) to PDF bytes
+    sale = invoice["sale"]
+    customer = invoice.get("customer") or {}
+    items = invoice.get("items") or []
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=18 * mm, rightMargin=18 * mm,
+                            topMargin=15 * mm, bottomMargin=15 * mm,
+                            title=f"INV-{sale['sales_id']}", author=COMPANY_NAME)
+    styles = getSampleStyleSheet()
+    story = []
+
+    header = Table([[Paragraph(f"<font color='white' size='14'><b>{COMPANY_NAME}</b></font>", styles["Title"])],
+                    [Paragraph(f"<font color='#ffcccc' size='9'>{COMPANY_ADDRESS}</font>", styles["Normal"])]],
+                   colWidths=[doc.width])
+    header.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (-1, -1), BRAND_RED),
+        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+        ("TOPPADDING", (0, 0), (-1, -1), 6),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+    ]))
+    story += [header, Spacer(1, 8 * mm)]
+    story.append(Paragraph("<font color='#d10000'><b>CHARGE SALES INVOICE</b></font>", styles["Heading3"]))
+
+    meta = [
+        ("Invoice No:", f"INV-{sale['sales_id']}"),
+        ("Date:", sale.get("date") or ""),
+        ("Charged to:", customer.get("name") or ""),
+        ("Address:", customer.get("address") or ""),
+        ("Business Style:", customer.get("business_style") or ""),
+        ("TIN:", customer.get("tin") or ""),
+    ]
+    meta_table = Table([[label, str(value)] for label, value in meta], colWidths=[35 * mm, doc.width - 35 * mm])
+    meta_table.setStyle(TableStyle([
+        ("FONTSIZE", (0, 0), (-1, -1), 9),
+        ("TEXTCOLOR", (0, 0), (0, -1), colors.HexColor("#777777")),
+        ("FONTNAME", (1, 0), (1, 2), "Helvetica-Bold"),
+    ]))
+    story += [meta_table, Spacer(1, 6 * mm)]
+
+    rows = [["Qty", "Unit", "Article", "U/P", "Amount"]]
+    for item in items:
+        rows.append([str(item.get("quantity", "")), "pcs", Paragraph(escape(str(item.get("name", ""))), styles["Normal"]),
+                     money(item.get("price")), money(item.get("subtotal"))])
+    items_table = Table(rows, colWidths=[15 * mm, 15 * mm, doc.width - 90 * mm, 30 * mm, 30 * mm], repeatRows=1)
+    items_table.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#f1f2f6")),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, -1), 9),
+        ("ALIGN", (3, 0), (3, -1), "CENTER"),
+        ("ALIGN", (4, 0), (4, -1), "RIGHT"),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("LINEBELOW", (0, 1), (-1, -1), 0.25, colors.HexColor("#eeeeee")),
+    ]))
+    story += [items_table, Spacer(1, 6 * mm)]
+
+    total = sale.get("total_amount")
+    totals = Table([["SubTotal:", money(total)], ["Total:", money(total)]], colWidths=[30 * mm, 35 * mm], hAlign="RIGHT")
+    totals.setStyle(TableStyle([
+        ("LINEABOVE", (0, 0), (-1, 0), 1.5, BRAND_RED),
+        ("FONTNAME", (0, 1), (-1, 1), "Helvetica-Bold"),
+        ("ALIGN", (1, 0), (1, -1), "RIGHT"),
+    ]))
+    story += [totals, Spacer(1, 10 * mm)]
+    story.append(Paragraph(f"<font size='8' color='#888888'>{LEGAL_NOTE}</font>", styles["Normal"]))
+
+    doc.build(story)
+    return buffer.getvalue()
+
+def render_invoice_batch(invoices):
+    # Worker entry point: renders several invoices per task to amortise pickling and IPC overhead
+    return [(invoice["sale"]["sales_id"], render_invoice_pdf(invoice)) for invoice in invoices]
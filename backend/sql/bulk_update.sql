@@ -0,0 +1,37 @@
+-- Batched partial updates used by PUT /api/bulk/<entity> in backend/app.py.
+-- Run once in the Supabase SQL editor.
+--
+-- bulk_patch_rows('product', 'product_id', array['retail_price'], '[{"product_id": 1, "retail_price": 9.5}, ...]')
+-- runs a single UPDATE ... FROM over the rows, writing only p_columns, and returns the ids that
+-- were actually updated. Unlike an upsert it never inserts, so NOT NULL columns that are not part
+-- of the patch are untouched and an id deleted in the meantime is simply not returned.
+create or replace function bulk_patch_rows(p_table text, p_id_column text, p_columns text[], p_rows jsonb)
+returns table (updated_id bigint)
+language plpgsql
+as $$
+declare
+    v_columns text;
+    v_values  text;
+begin
+    if p_table not in ('product', 'supplier', 'customer') then
+        raise exception 'bulk_patch_rows: table % is not allowed', p_table;
+    end if;
+
+    select string_agg(format('%I', c), ', '), string_agg(format('p.%I', c), ', ')
+      into v_columns, v_values
+      from unnest(p_columns) as c;
+    if v_columns is null then
+        return;
+    end if;
+
+    -- jsonb_populate_record casts every value to the column's own type
+    return query execute format(
+        'update %1$I t
+            set (%2$s) = (select %3$s from jsonb_populate_record(null::%1$I, r.value) p)
+           from jsonb_array_elements($1) as r(value)
+          where t.%4$I = (r.value ->> %5$L)::bigint
+         returning t.%4$I::bigint',
+        p_table, v_columns, v_values, p_id_column, p_id_column)
+    using p_rows;
+end;
+$$;
@@ -0,0 +1,108 @@
+-- Receivables ledger used by the CUSTOMER RECEIVABLES LEDGER section of backend/app.py.
+-- Run once in the Supabase SQL editor. The two functions below write the ledger row and the
+-- running balance in a single transaction, so concurrent sales and payments for the same
+-- customer can neither lose an update nor leave the balance and the ledger out of step.
+
+create table if not exists customer_ledger (
+    entry_id      bigint generated always as identity primary key,
+    customer_id   bigint not null,
+    entry_type    text not null check (entry_type in ('charge', 'payment')),
+    sales_id      bigint,
+    amount        numeric(12, 2) not null,
+    open_amount   numeric(12, 2) not null default 0,  -- unpaid part of a charge
+    date          date not null,
+    reference     text,
+    balance_after numeric(12, 2) not null default 0
+);
+
+create index if not exists customer_ledger_customer_idx on customer_ledger (customer_id, date, entry_id);
+
+-- At most one charge per sale: re-posting a sale (retry, backfill) is a no-op
+create unique index if not exists customer_ledger_sale_charge_idx
+    on customer_ledger (sales_id) where entry_type = 'charge';
+
+create table if not exists customer_balance (
+    customer_id   bigint primary key,
+    balance       numeric(12, 2) not null default 0,
+    total_charged numeric(12, 2) not null default 0,
+    total_paid    numeric(12, 2) not null default 0,
+    last_activity date
+);
+
+-- Posts the charge for one sale and adds it to the customer's balance.
+-- Returns {"posted": false} without touching the balance when the sale is already charged.
+create or replace function post_customer_charge(p_customer_id bigint, p_sales_id bigint,
+                                                p_amount numeric, p_date date)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_entry_id bigint;
+    v_balance  numeric;
+begin
+    insert into customer_ledger (customer_id, entry_type, sales_id, amount, open_amount, date, reference)
+    values (p_customer_id, 'charge', p_sales_id, p_amount, p_amount, p_date, 'INV-' || p_sales_id)
+    on conflict (sales_id) where entry_type = 'charge' do nothing
+    returning entry_id into v_entry_id;
+
+    if v_entry_id is null then
+        select balance into v_balance from customer_balance where customer_id = p_customer_id;
+        return jsonb_build_object('posted', false, 'balance', coalesce(v_balance, 0));
+    end if;
+
+    insert into customer_balance as b (customer_id, balance, total_charged, total_paid, last_activity)
+    values (p_customer_id, p_amount, p_amount, 0, p_date)
+    on conflict (customer_id) do update
+        set balance       = b.balance + excluded.balance,
+            total_charged = b.total_charged + excluded.total_charged,
+            last_activity = greatest(b.last_activity, excluded.last_activity)
+    returning balance into v_balance;
+
+    update customer_ledger set balance_after = v_balance where entry_id = v_entry_id;
+    return jsonb_build_object('posted', true, 'balance', v_balance);
+end;
+$$;
+
+-- Records a payment, settling the oldest open charges first; anything left over stays as credit.
+-- Returns {"balance", "applied": [{"sales_id", "amount"}], "unapplied"}.
+create or replace function post_customer_payment(p_customer_id bigint, p_amount numeric,
+                                                 p_date date, p_reference text default null)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_balance   numeric;
+    v_remaining numeric := p_amount;
+    v_settle    numeric;
+    v_applied   jsonb := '[]'::jsonb;
+    v_charge    record;
+begin
+    -- Updating the balance row first takes its lock, so payments for one customer run one at a time
+    insert into customer_balance as b (customer_id, balance, total_charged, total_paid, last_activity)
+    values (p_customer_id, -p_amount, 0, p_amount, p_date)
+    on conflict (customer_id) do update
+        set balance       = b.balance + excluded.balance,
+            total_paid    = b.total_paid + excluded.total_paid,
+            last_activity = greatest(b.last_activity, excluded.last_activity)
+    returning balance into v_balance;
+
+    for v_charge in
+        select entry_id, sales_id, open_amount
+        from customer_ledger
+        where customer_id = p_customer_id and entry_type = 'charge' and open_amount > 0
+        order by date, entry_id
+        for update
+    loop
+        exit when v_remaining <= 0;
+        v_settle := least(v_charge.open_amount, v_remaining);
+        update customer_ledger set open_amount = open_amount - v_settle where entry_id = v_charge.entry_id;
+        v_applied := v_applied || jsonb_build_array(jsonb_build_object('sales_id', v_charge.sales_id, 'amount', v_settle));
+        v_remaining := v_remaining - v_settle;
+    end loop;
+
+    insert into customer_ledger (customer_id, entry_type, amount, open_amount, date, reference, balance_after)
+    values (p_customer_id, 'payment', p_amount, 0, p_date, p_reference, v_balance);
+
+    return jsonb_build_object('balance', v_balance, 'applied', v_applied, 'unapplied', v_remaining);
+end;
+$$;
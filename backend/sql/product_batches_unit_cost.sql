@@ -0,0 +1,4 @@
+-- Per-batch cost for the FIFO valuation in GET /api/batches/report (backend/app.py).
+-- Run once in the Supabase SQL editor. receive_stock fills it with the delivery's retail_price;
+-- batches received before this column existed stay NULL and are valued at the product price.
+alter table product_batches add column if not exists unit_cost numeric(12, 2);
@@ -61,6 +61,24 @@ const Inventory = () => {
     return () => clearInterval(timer);
   }, []);
 
+  // Live stock updates from other terminals (server-sent events)
+  useEffect(() => {
+    const events = new EventSource(`${API_URL}/api/events?types=stock,product,archive,import`);
+    events.addEventListener('stock', (e) => {
+      const change = JSON.parse(e.data);
+      setProducts((prev) => prev.map((p) => (p.product_id === change.product_id ? { ...p, stock: change.stock } : p)));
+    });
+    events.addEventListener('product', () => fetchInventory());
+    events.addEventListener('resync', () => fetchInventory());
+    events.addEventListener('import', (e) => {
+      if (JSON.parse(e.data).entity === 'products') fetchInventory();
+    });
+    events.addEventListener('archive', (e) => {
+      if (JSON.parse(e.data).entity === 'product') fetchInventory();
+    });
+    return () => events.close();
+  }, []);
+
   const fetchInventory = async () => {
     try {
       const response = await fetch(`${API_URL}/api/inventory`);
@@ -60,6 +60,26 @@ const Transact = () => {
     return () => clearInterval(timer);
   }, []);
 
+  // Live stock updates from other terminals (server-sent events)
+  useEffect(() => {
+    const events = new EventSource(`${API_URL}/api/events?types=stock,product,archive,import`);
+    events.addEventListener('stock', (e) => {
+      const change = JSON.parse(e.data);
+      setInventory((prev) => prev.map((p) => (p.product_id === change.product_id ? { ...p, stock: change.stock } : p)));
+    });
+    events.addEventListener('product', () => fetchInventory());
+    events.addEventListener('resync', () => fetchInventory());
+    events.addEventListener('import', (e) => {
+      const { entity } = JSON.parse(e.data);
+      if (entity === 'products') fetchInventory();
+      if (entity === 'clients') fetchClients();
+    });
+    events.addEventListener('archive', (e) => {
+      if (JSON.parse(e.data).entity === 'product') fetchInventory();
+    });
+    return () => events.close();
+  }, []);
+
   // --- API CALLS ---
   const fetchInventory = async () => {
     try {